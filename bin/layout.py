@@ -13,11 +13,27 @@ optimizations in it to reduce layout time. -jsonch
 Usage: 
   with symb file: ./layout.py <input.dpt> --symb <input.symb>
   without symb file: ./layout.py <input.dpt>
+  search for a better placement order: ./layout.py <input.dpt> --search 64 [--jobs 8]
+  other targets: ./layout.py <input.dpt> --profile tofino2
+  compare targets: ./layout.py <input.dpt> --profile tofino1 --profile tofino2 --profile my_target.json
+  json report: ./layout.py <input.dpt> --report <report.json>
+  dependency graph: ./layout.py <input.dpt> --export-graph <graph.graphml>
+  every program in a directory: ./layout.py <dir> [--jobs 8]
+    (each <prog>.dpt is compiled with <prog>.symb, if it exists)
+
+Dataflow graphs and layout results are cached by content hash in 
+--cache-dir (default: ~/.cache/lucid/layout), so re-running on an 
+unchanged program is instant. --no-cache disables the cache.
 """
 
-import json, re, sys, os, subprocess, argparse, random
-import networkx as nx
-from collections import namedtuple
+import json, re, sys, os, subprocess, argparse, random, heapq, hashlib, io, shutil, contextlib, time, traceback
+import numpy as np
+from collections import namedtuple, Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+try:
+  import ijson
+except ImportError:
+  ijson = None
 
 script_dir = os.path.realpath(os.path.dirname(__file__))
 
@@ -25,22 +41,119 @@ parser = argparse.ArgumentParser()
 
 def main():
   parser.add_argument('--symb', type=str, required=False)
-  parser.add_argument('infn', type=str)
+  parser.add_argument('--search', type=int, default=0, 
+    help="try this many placement orders in parallel and keep the best one")
+  parser.add_argument('--jobs', type=int, default=None, 
+    help="number of processes to use for --search, several profiles, or a directory (default: number of cpus)")
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--cache-dir', type=str, default=default_cache_dir())
+  parser.add_argument('--no-cache', action='store_true', help="don't read or write the cache")
+  parser.add_argument('--no-build', action='store_true', help="don't rebuild lucid first")
+  parser.add_argument('--warm-start', action='store_true', 
+    help="put statement groups back where this program's last cached layout placed them, when still feasible "
+      "(the result can differ from a layout from scratch)")
+  parser.add_argument('--profile', type=str, action='append', 
+    help="resource profile: %s, or a json file. Repeat to compare several profiles."%(", ".join(RESOURCE_PROFILES)))
+  parser.add_argument('--report', type=str, required=False, 
+    help="write a json report of the layout (utilization, critical path, blocked groups, timing) to this file")
+  parser.add_argument('--export-graph', type=str, required=False, 
+    help="write the statement group dependency graph to this graphml file (requires networkx)")
+  parser.add_argument('infn', type=str, help="a lucid program, or a directory of them")
   args = parser.parse_args()
+  profiles = [load_profile(p) for p in (args.profile or [DEFAULT_PROFILE])]
+  if (len(profiles) > 1 and args.search):
+    parser.error("--search can only be used with one --profile")
+  program_dir = os.path.isdir(args.infn)
+  if (program_dir and (len(profiles) > 1 or args.symb or args.search or args.report or args.export_graph)):
+    parser.error("a directory can only be laid out with one --profile, and without --symb, --search, --report or --export-graph")
+  cache = None if args.no_cache else LayoutCache(args.cache_dir)
+  if (not args.no_build):
+    build_lucid()
+  if (program_dir):
+    layout_directory(args.infn, profiles[0], cache, args.jobs)
+    return
   tmpjson = args.infn + ".layout.json"
+  success, _ = compile_dfg(args.infn, args.symb, tmpjson, cache)
+  if (not success):
+    sys.exit(f"error: could not compile {args.infn} to a dataflow graph")
+
+  if (len(profiles) > 1):
+    layout_profiles(tmpjson, profiles, args.jobs)
+    return
+  profile = profiles[0]
+  hints = None
+  if (args.warm_start and cache and not args.search):
+    # start from the last placement of this program, if there is one
+    hints = cache.load("placement", source_cache_key(args.infn, profile))
+  layout_key = layout_cache_key(tmpjson, profile, args.search, args.seed, hints)
+  cached_layout = cache.load("layout", layout_key) if cache else None
+  if (cached_layout and (args.report is None or "json_report" in cached_layout)):
+    print (f"using cached layout of {tmpjson}")
+    print (cached_layout["report"], end="")
+    if (args.report):
+      write_report(args.report, cached_layout["json_report"])
+    if (args.export_graph):
+      # the graph isn't cached, but it doesn't depend on the layout
+      dg, groups = build_dependency_graph(tmpjson)
+      export_graph(args.export_graph, dg, groups, analyze_dependencies(dg))
+    return
+  print (f"laying out {tmpjson}")
+  start = time.perf_counter()
+  dg, groups = build_dependency_graph(tmpjson)
+  timing = {"build_dfg":time.perf_counter() - start}
+  start = time.perf_counter()
+  analysis = analyze_dependencies(dg)
+  timing["dependency_analysis"] = time.perf_counter() - start
+  if (args.export_graph):
+    export_graph(args.export_graph, dg, groups, analysis)
+  order = None
+  if (args.search):
+    order = search_layout(tmpjson, dg, analysis, profile, args.search, args.jobs, args.seed)
+  stats = {"timing":timing} if args.report else None
+  output = io.StringIO()
+  with contextlib.redirect_stdout(Tee(sys.stdout, output)):
+    pipe = layout(dg, groups, profile, order, hints, stats, analysis)
+  cache_entry = {"report":output.getvalue()}
+  if (args.report):
+    json_report = layout_report(pipe, groups, profile, stats)
+    json_report["program"] = args.infn
+    write_report(args.report, json_report)
+    cache_entry["json_report"] = json_report
+  if (cache):
+    cache.save("layout", layout_key, cache_entry)
+    cache.save("placement", source_cache_key(args.infn, profile), placement_hints(pipe, groups))
+  return
+
+def build_lucid():
   mk_cmd = f"cd {script_dir}/..; make all"
   print ("building lucid...")
   subprocess.call(mk_cmd, shell=True)
-  print (f"compiling {args.infn} to dataflow graph ({tmpjson})")
-  if (args.symb):
-    build_cmd = f"{script_dir}/dfgCompiler --symb {args.symb} {args.infn} -o {tmpjson}"
+
+def compile_dfg(infn, symb, dfg_fn, cache, quiet=False):
+  """ compile infn to a dataflow graph in dfg_fn, or copy it from the cache. 
+      Returns (success, cached). If quiet, the compiler's output goes 
+      to dfg_fn.log instead of the terminal. """
+  # without a built compiler there is nothing to key the cache by
+  use_cache = cache and os.path.exists(f"{script_dir}/dfgCompiler")
+  dfg_key = dfg_cache_key(infn, symb) if use_cache else None
+  if (use_cache and cache.copy_file("dfg", dfg_key, dfg_fn)):
+    if (not quiet):
+      print (f"using cached dataflow graph of {infn} ({dfg_fn})")
+    return True, True
+  if (not quiet):
+    print (f"compiling {infn} to dataflow graph ({dfg_fn})")
+  if (symb):
+    build_cmd = f"{script_dir}/dfgCompiler --symb {symb} {infn} -o {dfg_fn}"
   else:
-    build_cmd = f"{script_dir}/dfgCompiler {args.infn} -o {tmpjson}"
-  subprocess.call(build_cmd, shell=True)
-  print (f"laying out {tmpjson}")
-  dg, groups = build_dependency_graph(tmpjson)
-  pipe = layout(dg, groups)
-  return
+    build_cmd = f"{script_dir}/dfgCompiler {infn} -o {dfg_fn}"
+  if (quiet):
+    with open(dfg_fn + ".log", "w") as logf:
+      ret = subprocess.call(build_cmd, shell=True, stdout=logf, stderr=subprocess.STDOUT)
+  else:
+    ret = subprocess.call(build_cmd, shell=True)
+  if (use_cache and ret == 0):
+    cache.store_file("dfg", dfg_key, dfg_fn)
+  return ret == 0, False
 
 Array = namedtuple("Array", "id ty size")
 Variable = namedtuple("Variable", "id ty size")
@@ -82,12 +195,27 @@ def stmt_resources(stmt, vars, arrs):
     "alu_ops":alu_ops
     }
 
+# make the same dictionary from the structured resource 
+# fields that newer versions of dfgCompiler export
+def resources_from_json(js, vars, arrs):
+  return {
+    "arrays":[arrs[aid] for aid in set(js["arrays"])],
+    "keys":[vars[kid] for kid in js["keys"]],
+    "array_ops":js["array_ops"],
+    "hash_ops":js["hash_ops"],
+    "alu_ops":js["alu_ops"]
+    }
+
 def stmt_from_json(js, vars, arrs):
   stmt = js["statement"]
   user_table = False
   if (js["user_table"] == "true"):
     user_table = True
-  return Statement(js["id"], stmt, user_table, stmt_resources(stmt, vars, arrs))
+  if ("resources" in js):
+    resources = resources_from_json(js["resources"], vars, arrs)
+  else: # fall back to parsing the statement's text
+    resources = stmt_resources(stmt, vars, arrs)
+  return Statement(js["id"], stmt, user_table, resources)
 
 
 # we are laying out groups / bundles of statement. Each bundle contains 
@@ -102,6 +230,22 @@ def groupid_of_stmt(s):
     print ("error -- statement accesses more than 1 array. Impossible.")
     exit(1)
 
+SRAM_BLOCK_SIZE = 1024 * 128 # 128 kb
+
+def sram_blocks(array):
+  return (array.size // SRAM_BLOCK_SIZE) + 2
+
+# fixed order of the resources in a resource vector
+RESOURCES = ("keybits", "sram_blocks", "arrays", "hash_ops", "array_ops")
+# resources that two different statement groups can never share 
+# (each array belongs to exactly one group), so a group's vector 
+# is a lower bound of how much it adds to any table.
+UNSHARED_RESOURCES = np.array([r in ("sram_blocks", "arrays") for r in RESOURCES])
+
+def constraint_vector(constraints):
+  """ dict of resource limits -> resource vector (unconstrained resources are inf) """
+  return np.array([constraints.get(r, np.inf) for r in RESOURCES], dtype=float)
+
 class StatementGroup (object):
   """ A group of statements that must go into the same stage
       (either because that all use the same array, or because 
@@ -110,6 +254,14 @@ class StatementGroup (object):
     self.gid = gid
     self.statements = []
     self.user_table = False
+    # multisets of the resource units (keys, arrays, ops) used by the statements. 
+    # resources are derived from these incrementally, as statements are added.
+    self.units = {
+      "keys":Counter(),
+      "arrays":Counter(),
+      "hash_ops":Counter(),
+      "array_ops":Counter()
+    }
     # resources required by this statement group
     self.resources = {
       "keybits":0,
@@ -119,40 +271,59 @@ class StatementGroup (object):
       "array_ops":0
     }
 
-  def calc_keybits(self):
-    keys = []
-    for stmt in self.statements:
-      keys += stmt.resources["keys"]
-    keys = list(set(keys))
-    self.resources["keybits"] = sum([mv.size for mv in keys])
-
-  def calc_sram(self):
-    sram_block_size = 1024 * 128 # 128 kb
-    arrays = []
-    for stmt in self.statements:
-      arrays += stmt.resources["arrays"]
-    arrays = list(set(arrays))
-    self.resources["sram_blocks"] = sum([(array.size // sram_block_size) + 2 for array in arrays])
-
-  def count_resource(self, resource):
-    units = []
-    for stmt in self.statements:
-      units += stmt.resources[resource]
-    self.resources[resource] = len(list(set(units)))
-
-  def calc_resources(self):
-    """ calculate this statement groups resource footprint """
-    self.calc_keybits()
-    self.calc_sram()
-    self.count_resource("arrays")
-    self.count_resource("hash_ops")
-    self.count_resource("array_ops")
+  def resource_delta(self, units):
+    """ how much each resource would grow if units (a statement's 
+        resources, or another group's units) were added to this group """
+    delta = {r:0 for r in self.resources}
+    for key in set(units["keys"]):
+      if (key not in self.units["keys"]):
+        delta["keybits"] += key.size
+    for array in set(units["arrays"]):
+      if (array not in self.units["arrays"]):
+        delta["sram_blocks"] += sram_blocks(array)
+        delta["arrays"] += 1
+    for resource in ["hash_ops", "array_ops"]:
+      delta[resource] = len(set(units[resource]) - self.units[resource].keys())
+    return delta
+
+  def add_units(self, units):
+    delta = self.resource_delta(units)
+    for resource, counter in self.units.items():
+      counter.update(units[resource])
+    for resource, inc in delta.items():
+      self.resources[resource] += inc
 
   def add_stmt(self, stmt):
-    self.statements = self.statements + [stmt]
+    self.statements.append(stmt)
     self.user_table = self.user_table or stmt.user_table
     # update resources
-    self.calc_resources()
+    self.add_units(stmt.resources)
+
+  def merge(self, sg):
+    """ add all of sg's statements to this group """
+    self.statements.extend(sg.statements)
+    self.user_table = self.user_table or sg.user_table
+    self.add_units(sg.units)
+
+  def signature(self):
+    """ hash of the group's statements, to recognize 
+        the same group in a different compilation """
+    h = hashlib.sha1(str(self.user_table).encode())
+    for stmt in sorted([s.statement for s in self.statements]):
+      h.update(stmt.encode())
+    return h.hexdigest()
+
+  def resource_vector(self):
+    return np.array([self.resources[r] for r in RESOURCES], dtype=float)
+
+  def fits_with(self, sg, constraints):
+    """ would merging sg into this group obey a dict of constraints? 
+        (checked without building the merged group) """
+    delta = self.resource_delta(sg.units)
+    for resource, limit in constraints.items():
+      if (self.resources[resource] + delta[resource] > limit):
+        return False
+    return True
 
   def node_key(self):
     return (self.gid)#, {"obj":self})
@@ -177,35 +348,147 @@ class Dependency(object):
   def edge_key(self):
     return (self.srcid, self.dstid)#, {"obj":self})
 
+def csr_adjacency(src, dst, n):
+  """ CSR adjacency arrays (ptr, idx) of the edges src -> dst over n nodes. 
+      The neighbors of each node stay in edge order. """
+  perm = np.argsort(src, kind="stable")
+  ptr = np.zeros(n+1, dtype=np.int64)
+  np.cumsum(np.bincount(src, minlength=n), out=ptr[1:])
+  return ptr, dst[perm]
+
+def gather_neighbors(ptr, idx, nodes):
+  """ the concatenated neighbor lists of nodes, in order """
+  starts = ptr[nodes]
+  lens = ptr[nodes+1] - starts
+  offsets = np.repeat(starts - (np.cumsum(lens) - lens), lens) + np.arange(lens.sum())
+  return idx[offsets]
+
+class DependencyDag(object):
+  """ A compact dag of statement groups. Groups are numbered in the order 
+      they are given, and edges are stored as CSR adjacency arrays in both 
+      directions. networkx is only used to export the dag (to_networkx). """
+  def __init__(self, gids, edges):
+    self.gids = list(gids)
+    self.index = {gid:i for i, gid in enumerate(self.gids)}
+    n = len(self.gids)
+    # a group can't depend on itself in the layout (all its statements 
+    # go in the same stage), so self-dependencies are dropped
+    edges = [(self.index[src], self.index[dst]) for src, dst in edges if src != dst]
+    src, dst = np.array(edges, dtype=np.int64).reshape(-1, 2).T
+    self.succ_ptr, self.succ_idx = csr_adjacency(src, dst, n)
+    self.pred_ptr, self.pred_idx = csr_adjacency(dst, src, n)
+    # list copies, for fast per-group lookups from python
+    self.succ_lists = self.succ_ptr.tolist(), self.succ_idx.tolist()
+    self.pred_lists = self.pred_ptr.tolist(), self.pred_idx.tolist()
+
+  def __len__(self):
+    return len(self.gids)
+
+  def successors(self, gid):
+    ptr, idx = self.succ_lists
+    i = self.index[gid]
+    return [self.gids[j] for j in idx[ptr[i]:ptr[i+1]]]
+
+  def predecessors(self, gid):
+    ptr, idx = self.pred_lists
+    i = self.index[gid]
+    return [self.gids[j] for j in idx[ptr[i]:ptr[i+1]]]
+
+  def in_degree(self):
+    return zip(self.gids, np.diff(self.pred_ptr).tolist())
+
+  def generations(self, reverse=False):
+    """ the topological generations of the dag (or of the reversed dag): 
+        the groups with no predecessors, then the groups whose predecessors 
+        are all in the first generation, and so on. Each generation is an 
+        array of group numbers, in the order that networkx would visit them. """
+    ptr, idx = (self.pred_ptr, self.pred_idx) if reverse else (self.succ_ptr, self.succ_idx)
+    remaining = np.diff(self.succ_ptr if reverse else self.pred_ptr)
+    gen = np.flatnonzero(remaining == 0)
+    generations = []
+    while len(gen):
+      generations.append(gen)
+      children = gather_neighbors(ptr, idx, gen)
+      np.subtract.at(remaining, children, 1)
+      # a child becomes ready at its last occurrence in children
+      rev_children, rev_pos = np.unique(children[::-1], return_index=True)
+      ready = remaining[rev_children] == 0
+      last_pos = len(children) - 1 - rev_pos[ready]
+      gen = rev_children[ready][np.argsort(last_pos)]
+    if (sum(map(len, generations)) != len(self.gids)):
+      print ("error -- the dependency graph has a cycle.")
+      exit(1)
+    return generations
+
+  def to_networkx(self, node_attrs=None):
+    import networkx as nx
+    g = nx.DiGraph()
+    for gid in self.gids:
+      g.add_node(gid, **(node_attrs or {}).get(gid, {}))
+    ptr, idx = self.succ_lists
+    for i, gid in enumerate(self.gids):
+      g.add_edges_from([(gid, self.gids[j]) for j in idx[ptr[i]:ptr[i+1]]])
+    return g
+
+DFG_SECTIONS = ("arrays", "vars", "statements", "dependencies")
+
+def iter_dfg_json(json_fn):
+  """ yield (section, item) for every item in the top-level lists 
+      of a dfg json, in file order. If ijson is installed, the file 
+      is streamed rather than loaded all at once. """
+  if (ijson is None):
+    prog_json = json.load(open(json_fn, "r"))
+    for section in DFG_SECTIONS:
+      for item in prog_json[section]:
+        yield section, item
+    return
+  item_prefixes = {section+".item":section for section in DFG_SECTIONS}
+  builder = None
+  with open(json_fn, "rb") as f:
+    for prefix, event, value in ijson.parse(f):
+      if (builder is None):
+        if (event != "start_map" or prefix not in item_prefixes):
+          continue
+        builder = ijson.ObjectBuilder()
+      builder.event(event, value)
+      if (event == "end_map" and prefix in item_prefixes):
+        yield item_prefixes[prefix], builder.value
+        builder = None
+
 def build_dependency_graph(json_fn):
-  prog_json = json.load(open(json_fn, "r"))
-  arrs = {arr["id"]:arr_from_json(arr) for arr in prog_json["arrays"]}
-  vars = {v["id"]:var_from_json(v) for v in prog_json["vars"]}
-  stmts = {st["id"]:stmt_from_json(st, vars, arrs) for st in prog_json["statements"]}
-  # generate statement groups
+  # dfgCompiler exports the arrays and vars before the statements 
+  # that use them, and the statements before their dependencies, 
+  # so everything can be built in one pass over the file.
+  arrs, vars, stmts = {}, {}, {}
   groups = {}  # array or stmt id -> group
-  for s in stmts.values():
-    group_id = groupid_of_stmt(s)
-    group = groups.get(group_id, StatementGroup(group_id))
-    group.add_stmt(s)
-    groups[group_id] = group
-  # find dependencies between statement groups 
   deps = {} # (src, dst) -> dep obj
-  for dep in prog_json["dependencies"]:
-    src_group_id = groupid_of_stmt(stmts[dep["srcid"]])
-    dst_group_id = groupid_of_stmt(stmts[dep["dstid"]])
-    key = (src_group_id, dst_group_id)
-    d = deps.get(key, Dependency(src_group_id, dst_group_id))
-    d.add_dep_ty(dep["dep_ty"])
-    deps[key] = d
-
-  dg = nx.DiGraph()
+  for section, item in iter_dfg_json(json_fn):
+    if (section == "arrays"):
+      arrs[item["id"]] = arr_from_json(item)
+    elif (section == "vars"):
+      vars[item["id"]] = var_from_json(item)
+    elif (section == "statements"):
+      # generate statement groups
+      s = stmt_from_json(item, vars, arrs)
+      stmts[s.id] = s
+      group_id = groupid_of_stmt(s)
+      group = groups.get(group_id, StatementGroup(group_id))
+      group.add_stmt(s)
+      groups[group_id] = group
+    else:
+      # find dependencies between statement groups 
+      src_group_id = groupid_of_stmt(stmts[item["srcid"]])
+      dst_group_id = groupid_of_stmt(stmts[item["dstid"]])
+      key = (src_group_id, dst_group_id)
+      d = deps.get(key, Dependency(src_group_id, dst_group_id))
+      d.add_dep_ty(item["dep_ty"])
+      deps[key] = d
+
   nodes = [sg.node_key() for sg in groups.values()][::-1]
   edges = [dep.edge_key() for dep in deps.values()][::-1]
   # random.shuffle(nodes)
   # random.shuffle(edges)
-  dg.add_nodes_from(nodes)
-  dg.add_edges_from(edges)
+  dg = DependencyDag(nodes, edges)
   return dg, groups
 
 # find the minimum stage for each group based
@@ -222,40 +505,143 @@ def min_stage_from_dependencies(group, dg, groups):
       min_stage = max(min_stage, (pred_group.stage+1))
   return min_stage
 
+# longest-path analysis of the dependency graph. earliest is the first 
+# stage a group can go in (the dependency-only layout), latest is the 
+# last stage it can go in without making the dependency-only layout 
+# longer, and slack is the difference. Groups with 0 slack are on a 
+# critical path.
+DependencyAnalysis = namedtuple("DependencyAnalysis", "order earliest latest slack n_stages")
 
+def analyze_dependencies(dg):
+  """ a group's earliest stage is its topological generation, and its latest 
+      stage is counted back from the last stage by its generation in the 
+      reversed dag. The order is the generations, concatenated. """
+  n = len(dg)
+  generations = dg.generations()
+  n_stages = len(generations)
+  earliest, latest = np.zeros(n, dtype=np.int64), np.zeros(n, dtype=np.int64)
+  for stage, gen in enumerate(generations):
+    earliest[gen] = stage
+  for height, gen in enumerate(dg.generations(reverse=True)):
+    latest[gen] = n_stages - 1 - height
+  order = np.concatenate(generations).tolist() if n else []
+  gid_dict = lambda arr: dict(zip(dg.gids, arr.tolist()))
+  return DependencyAnalysis([dg.gids[i] for i in order], 
+    gid_dict(earliest), gid_dict(latest), gid_dict(latest - earliest), n_stages)
 
+def placement_order(dg, analysis, strategy="slack", seed=0):
+  """ a topological order of dg to place groups in. 
+      "slack" : among the groups whose predecessors are placed, the one 
+                with the least slack first (ties in topological order)
+      "topological" : the plain topological sort
+      "height" : groups on the longest dependency chains first, ties broken randomly
+      "random" : a uniformly random choice among the ready groups at each step """
+  if (strategy == "topological"):
+    return analysis.order
+  rng = random.Random(seed)
+  position = {gid:i for i, gid in enumerate(analysis.order)}
+  if (strategy == "slack"):
+    priority = lambda gid: (analysis.slack[gid], position[gid])
+  elif (strategy == "height"):
+    # the longest chain starting at a group ends in the 
+    # last stage, so its height is n_stages - latest
+    priority = lambda gid: (analysis.latest[gid], rng.random())
+  else:
+    priority = lambda gid: (rng.random(),)
+  in_degree = dict(dg.in_degree())
+  ready = [(priority(gid), gid) for gid, deg in in_degree.items() if deg == 0]
+  heapq.heapify(ready)
+  order = []
+  while ready:
+    _, gid = heapq.heappop(ready)
+    order.append(gid)
+    for succ in dg.successors(gid):
+      in_degree[succ] -= 1
+      if (in_degree[succ] == 0):
+        heapq.heappush(ready, (priority(succ), succ))
+  return order
 
-# combine 2 statement groups
-def merge_statement_groups(sg1, sg2):
-  new_g = StatementGroup(sg1.gid)
-  new_g.statements = sg1.statements + sg2.statements
-  for s in new_g.statements:
-    new_g.user_table = new_g.user_table or s.user_table
-  new_g.calc_resources()
-  return new_g
 
-# check if a statement group obeys a list of constraints
-def check_statement_group(sg, constraints):
-  for resource, limit in constraints.items():
-    if (sg.resources[resource] > limit):
-      return False
-  return True
 
 
 # A simple resource model of the tofino pipeline: 
 # a pipeline of stages, each stage has tables. 
 # tables implement statements 
-class Table(object):
-  """ A physical tofino table """
-  def __init__(self, table_id):
-    # resource constraints
-    self.constraints = {
+
+# the size of the pipeline and the resource limits of its stages and 
+# tables, for different targets. A resource with no limit in a stage 
+# is only constrained by the limits of the stage's tables.
+RESOURCE_PROFILES = {
+  "tofino1" : {
+    "n_stages" : 12,
+    "n_tables" : 16,
+    "table" : {
       "keybits" : 512,
       "arrays" : 1,
       "sram_blocks": 35,
       "hash_ops" : 1,
       "array_ops": 4
+    },
+    "stage" : {
+      "arrays" : 4,
+      "sram_blocks": 48,
+      "hash_ops" : 6,
+      # "array_ops": 4
     }
+  },
+  "tofino2" : {
+    "n_stages" : 20,
+    "n_tables" : 16,
+    "table" : {
+      "keybits" : 512,
+      "arrays" : 1,
+      "sram_blocks": 35,
+      "hash_ops" : 1,
+      "array_ops": 4
+    },
+    "stage" : {
+      "arrays" : 4,
+      "sram_blocks": 80,
+      "hash_ops" : 6,
+    }
+  }
+}
+DEFAULT_PROFILE = "tofino1"
+
+def load_profile(name_or_fn):
+  """ a preset resource profile, or a user-defined one from a json file. 
+      A user-defined profile only needs the fields that differ from 
+      the preset named in its "base" field (default: tofino1). """
+  if (name_or_fn in RESOURCE_PROFILES):
+    profile = json.loads(json.dumps(RESOURCE_PROFILES[name_or_fn]))
+    profile["name"] = name_or_fn
+    return profile
+  if (not os.path.exists(name_or_fn)):
+    print (f"error -- {name_or_fn} is not a preset resource profile ({', '.join(RESOURCE_PROFILES)}) or a file.")
+    exit(1)
+  user_profile = json.load(open(name_or_fn, "r"))
+  profile = load_profile(user_profile.get("base", DEFAULT_PROFILE))
+  for field, value in user_profile.items():
+    if (field in ("table", "stage")):
+      unknown = [r for r in (value if isinstance(value, dict) else [None]) if r not in RESOURCES]
+      if (unknown):
+        print (f"error -- {name_or_fn}: \"{field}\" must map resources ({', '.join(RESOURCES)}) to limits, not {unknown}")
+        exit(1)
+      profile[field].update(value)
+    elif (field in ("n_stages", "n_tables", "base", "name")):
+      profile[field] = value
+    else:
+      print (f"error -- {name_or_fn}: unknown resource profile field \"{field}\" "
+        "(expected n_stages, n_tables, table, stage, base or name)")
+      exit(1)
+  profile["name"] = user_profile.get("name", os.path.basename(name_or_fn))
+  return profile
+
+class Table(object):
+  """ A physical tofino table """
+  def __init__(self, table_id, constraints):
+    # resource constraints
+    self.constraints = constraints
     # contents
     self.table_id = table_id
     self.active = False
@@ -267,9 +653,8 @@ class Table(object):
     # cannot merge two user tables
     if (self.statement_group.user_table and sg.user_table):
       return False
-    new_g = merge_statement_groups(self.statement_group, sg)
-    if (check_statement_group(new_g, self.constraints)):
-      self.statement_group = new_g
+    if (self.statement_group.fits_with(sg, self.constraints)):
+      self.statement_group.merge(sg)
       self.active = True
       return True
     else:
@@ -286,49 +671,107 @@ class Table(object):
 
 class Stage(object):
   """ A physical tofino stage """
-  def __init__(self, stage_id, n_tables):
+  def __init__(self, stage_id, n_tables, constraints, table_constraints):
     self.stage_id = stage_id
-    self.constraints = {
-      "arrays" : 4,
-      "sram_blocks": 48,
-      "hash_ops" : 6,
-      # "array_ops": 4
-    }
-    self.tables = [Table(i) for i in range(n_tables)]      
+    self.constraints = constraints
+    self.tables = [Table(i, table_constraints) for i in range(n_tables)]      
   
-  # can the new statement group fit into this stage?
-  def check_resources(self, new_statement_group):
-    for resource, limit in self.constraints.items():
-      total = new_statement_group.resources[resource] + sum([t.statement_group.resources[resource] for t in self.tables])
-      if (total > limit):
-        return False
-    return True
-
-  def add_group(self, sg):
-    if (not self.check_resources(sg)):
-      return None
-    loc = None
-    for t in self.tables:
-      success = t.add_group(sg)
-      if success:
-        loc = (self.stage_id, t.table_id)
-        print ("placed in (stage, table): (%i, %i)"%loc)
-        break
-    return loc
   def __str__(self):
     return f"stage {self.stage_id} "+"{\n"+"\n".join([str(t) for t in self.tables if t.active])+"\n}"
 
 class Pipeline(object):
   """ The tofino match-action pipeline """
-  def __init__(self, n_stages, n_tables):
+  def __init__(self, profile):
+    n_stages, n_tables = profile["n_stages"], profile["n_tables"]
     # contents
-    self.stages = [Stage(i, n_tables) for i in range(n_stages)]
+    self.stages = [Stage(i, n_tables, profile["stage"], profile["table"]) for i in range(n_stages)]
+    # resource usage of every table and stage, as resource vectors
+    self.table_usage = np.zeros((n_stages, n_tables, len(RESOURCES)))
+    self.stage_usage = np.zeros((n_stages, len(RESOURCES)))
+    self.user_tables = np.zeros((n_stages, n_tables), dtype=bool)
+    self.table_limits = constraint_vector(self.stages[0].tables[0].constraints)
+    self.stage_limits = constraint_vector(self.stages[0].constraints)
+    # (gid, stage, table) of each group, in the order they were placed
+    self.placement = []
+
+  def candidate_tables(self, sg, min_stage):
+    """ mask of the (stage, table) slots that pass a vectorized 
+        feasibility check for sg. The stage check is exact. The table 
+        check only counts resources that cannot be shared, so slots 
+        that fail it definitely can't hold sg, but slots that pass still 
+        need an exact check (keys and ops may overlap with the table's). """
+    vec = sg.resource_vector()
+    stage_ok = np.all(self.stage_usage + vec <= self.stage_limits, axis=1)
+    lower = np.where(UNSHARED_RESOURCES, vec, 0)
+    table_ok = np.all(self.table_usage + lower <= self.table_limits, axis=2)
+    table_ok &= stage_ok[:, None]
+    if (sg.user_table):
+      table_ok &= ~self.user_tables
+    table_ok[:min_stage] = False
+    return table_ok
+
+  def place(self, sg, s, t):
+    table = self.stages[s].tables[t]
+    if table.add_group(sg):
+      self.table_usage[s, t] = table.statement_group.resource_vector()
+      self.stage_usage[s] = self.table_usage[s].sum(axis=0)
+      self.user_tables[s, t] = table.statement_group.user_table
+      self.placement.append((sg.gid, int(s), int(t)))
+      return (int(s), int(t))
+    return None
+
   def add_group(self, sg, min_stage):
-    for s in self.stages[min_stage::]:
-      loc = s.add_group(sg)
+    # candidates come out in (stage, table) order, so this 
+    # is the same first-fit placement as checking every table.
+    for (s, t) in np.argwhere(self.candidate_tables(sg, min_stage or 0)):
+      loc = self.place(sg, s, t)
       if loc is not None:
         return loc
     return None
+
+  def add_group_at(self, sg, min_stage, s, t):
+    """ place sg in table t of stage s, if it fits there """
+    if (s >= len(self.stages) or t >= len(self.stages[s].tables)):
+      return None
+    if (not self.candidate_tables(sg, min_stage or 0)[s, t]):
+      return None
+    return self.place(sg, s, t)
+  def stage_utilization(self):
+    """ fraction of each stage's resources in use. Resources 
+        without a stage limit are relative to the sum of its table limits """
+    n_tables = len(self.stages[0].tables)
+    capacity = np.where(np.isinf(self.stage_limits), n_tables*self.table_limits, self.stage_limits)
+    return self.stage_usage / capacity
+
+  def table_utilization(self):
+    return self.table_usage / self.table_limits
+
+  def blocking_constraints(self, sg, first_stage, last_stage):
+    """ why sg doesn't fit in any stage from first_stage up to (not including) 
+        last_stage: the stage resources that sg would put over their limit, 
+        and how many of the stage's tables each table constraint rules out. """
+    vec = sg.resource_vector()
+    blocked = []
+    for s in range(first_stage, last_stage):
+      over = self.stage_usage[s] + vec > self.stage_limits
+      table_reasons = Counter()
+      for table in self.stages[s].tables:
+        if (table.statement_group.user_table and sg.user_table):
+          table_reasons["user_table"] += 1
+          continue
+        delta = table.statement_group.resource_delta(sg.units)
+        for resource, limit in table.constraints.items():
+          if (table.statement_group.resources[resource] + delta[resource] > limit):
+            table_reasons[resource] += 1
+      blocked.append({
+        "stage":s, 
+        "stage_constraints":[r for r, o in zip(RESOURCES, over) if o],
+        "table_constraints":dict(table_reasons)
+      })
+    return blocked
+
+  def n_stages_used(self):
+    return len([s for s in self.stages if any(t.active for t in s.tables)])
   def __str__(self):
     st = ""
     for s in self.stages:
@@ -338,46 +781,433 @@ class Pipeline(object):
     return st
 
 
-def layout_dependencies_only(dg, groups):
-  """ layout based only on dependencies -- this is a lower bound of stages """
-  dep_stages = []
-  for gid in nx.topological_sort(dg):
-    dependency_stage = min_stage_from_dependencies(groups[gid], dg, groups)
+def layout_dependencies_only(dg, groups, analysis):
+  """ layout based only on dependencies -- this is a lower bound of stages. 
+      Returns the longest chain of dependent groups (the critical path) """
+  for gid, dependency_stage in analysis.earliest.items():
     groups[gid].stage=dependency_stage
-    dep_stages.append(dependency_stage)
-  print (f"number of stages (dependencies only): {max(dep_stages)+1}")
+  print (f"number of stages (dependencies only): {analysis.n_stages}")
+  # walk back from the last group, through predecessors in the previous stage
+  gid = max(groups, key=lambda gid: groups[gid].stage)
+  path = [gid]
+  while (groups[gid].stage > 0):
+    gid = next(p for p in dg.predecessors(gid) if groups[p].stage == groups[gid].stage - 1)
+    path.append(gid)
+  return path[::-1]
 
 
-def layout(dg, groups):
+def place_groups(dg, groups, order, profile, verbose=False, hints=None, blocked=None):
+  """ place the statement groups into a new pipeline, in order 
+      (a topological order of dg). Returns None if a group doesn't fit. 
+      hints maps group signatures to a list of (stage, table) locations 
+      from an earlier layout; a group is put back in its old location 
+      when that is still feasible. If blocked is a dict, it is filled 
+      with the constraints that kept each group out of earlier stages. """
+  pipe = Pipeline(profile)
+  hints = {sig:list(locs) for sig, locs in (hints or {}).items()}
+  n_kept = 0
+  for gid in order:
+    if (verbose):
+      print ("placing: %s"%gid)
+    dependency_stage = min_stage_from_dependencies(groups[gid], dg, groups)
+    loc = None
+    old_locs = hints.get(groups[gid].signature()) if hints else None
+    if (old_locs):
+      loc = pipe.add_group_at(groups[gid], dependency_stage, *old_locs.pop(0))
+      n_kept += loc is not None
+    if (loc is None):
+      loc = pipe.add_group(groups[gid], dependency_stage)
+    if (loc is None):
+      if (verbose):
+        print ("error -- could not place statement group %s"%gid)
+      return None
+    if (verbose):
+      print ("placed in (stage, table): (%i, %i)"%loc)
+    if (blocked is not None and loc[0] > (dependency_stage or 0)):
+      blocked[gid] = pipe.blocking_constraints(groups[gid], dependency_stage or 0, loc[0])
+    groups[gid].stage = loc[0]
+  if (verbose and hints):
+    print ("kept %i of %i statement groups at their cached locations"%(n_kept, len(order)))
+  return pipe
+
+def layout(dg, groups, profile, order=None, hints=None, stats=None, analysis=None):
   """ layout based on dependencies and pipeline resources -- 
       this is approximately equal to lucid compiler, though there may be variations due 
-      to the order in which statements are placed. """
-  pipe = Pipeline(12, 16)
-  print ("**** starting layout ****")  
+      to the order in which statements are placed. By default, groups with the least 
+      slack are placed first. 
+      If stats is a dict, it is filled with the data for layout_report. """
+  print (f"**** starting layout ({profile['name']}) ****")  
+  if (hints):
+    print (f"starting from a cached placement of {sum(map(len, hints.values()))} statement groups")
+  timing = {} if stats is None else stats.setdefault("timing", {})
+  blocked = None if stats is None else stats.setdefault("blocked", {})
   # layout can be done in a single topologically 
   # ordered pass through the statement groups
-  for gid in nx.topological_sort(dg):
-    print ("placing: %s"%gid)
-    dependency_stage = min_stage_from_dependencies(groups[gid], dg, groups)
-    stage, table = pipe.add_group(groups[gid], dependency_stage)
-    groups[gid].stage=stage
+  start = time.perf_counter()
+  if (analysis is None):
+    analysis = analyze_dependencies(dg)
+    timing["dependency_analysis"] = time.perf_counter() - start
+  if (order is None):
+    order = placement_order(dg, analysis)
+  start = time.perf_counter()
+  pipe = place_groups(dg, groups, order, profile, verbose=True, hints=hints, blocked=blocked)
+  timing["placement"] = time.perf_counter() - start
+  if (pipe is None):
+    exit(1)
 
   print ("**** layout finished ****")
   print (str(pipe))
   print ("**** resources ****")
-  n_stages_used = 0
   for s in pipe.stages:
     n_active = len([t for t in s.tables if t.active])
     if (n_active):
-      n_stages_used += 1
       print ("---- stage %i [%i tables] ----"%(s.stage_id, n_active))
       for t in s.tables:
         if (t.active):
           print (t.resource_summary())
 
-  layout_dependencies_only(dg, groups)
-  print (f"number of stages (full layout): {n_stages_used}")
+  print ("**** stage pressure ****")
+  print (stage_pressure_heatmap(pipe))
+
+  start = time.perf_counter()
+  critical_path = layout_dependencies_only(dg, groups, analysis)
+  timing["dependencies_only"] = time.perf_counter() - start
+  if (stats is not None):
+    stats["critical_path"] = critical_path
+    stats["slack"] = analysis.slack
+  print (f"number of stages (full layout): {pipe.n_stages_used()}")
   return pipe
 
+
+#### reports ####
+PRESSURE_SHADES = " .:-=+*#%@"
+
+def stage_pressure_heatmap(pipe):
+  """ a text table of each active stage's resource utilization, with 
+      a bar showing the utilization of its most constrained resource """
+  util = pipe.stage_utilization()
+  lines = ["stage " + " ".join([r.rjust(11) for r in RESOURCES]) + "  pressure"]
+  for s in pipe.stages:
+    if (not any(t.active for t in s.tables)):
+      continue
+    row = util[s.stage_id]
+    shade = PRESSURE_SHADES[min(int(max(row) * len(PRESSURE_SHADES)), len(PRESSURE_SHADES)-1)]
+    bar = shade * int(round(min(max(row), 1) * 10))
+    lines.append("%5i "%s.stage_id + " ".join([("%i%%"%round(u*100)).rjust(11) for u in row]) + "  |%s|"%bar.ljust(10))
+  return "\n".join(lines)
+
+def layout_report(pipe, groups, profile, stats):
+  """ a json-able report of a finished layout """
+  stage_util, table_util = pipe.stage_utilization(), pipe.table_utilization()
+  table_groups = defaultdict(list) # (stage, table) -> group ids
+  placed_stage = {}
+  for gid, s, t in pipe.placement:
+    table_groups[(s, t)].append(gid)
+    placed_stage[gid] = s
+  stages = []
+  for s in pipe.stages:
+    tables = [{
+        "table":t.table_id, 
+        "groups":table_groups[(s.stage_id, t.table_id)],
+        "n_statements":len(t.statement_group.statements),
+        "resources":dict(t.statement_group.resources),
+        "utilization":dict(zip(RESOURCES, table_util[s.stage_id, t.table_id].tolist()))
+      } for t in s.tables if t.active]
+    if (tables == []):
+      continue
+    stages.append({
+      "stage":s.stage_id, 
+      "n_tables":len(tables),
+      "resources":dict(zip(RESOURCES, pipe.stage_usage[s.stage_id].tolist())),
+      "utilization":dict(zip(RESOURCES, stage_util[s.stage_id].tolist())),
+      "tables":tables
+    })
+  def group_summary(gid):
+    return {"group":gid, "statements":[stmt.id for stmt in groups[gid].statements]}
+  return {
+    "profile":profile,
+    "n_stages":pipe.n_stages_used(),
+    "n_stages_dependencies_only":max(sg.stage for sg in groups.values()) + 1,
+    "stages":stages,
+    # after layout(), groups[gid].stage is the stage from the dependency-only layout
+    "critical_path":[dict(group_summary(gid), 
+        dependency_stage=groups[gid].stage, stage=placed_stage[gid]) 
+      for gid in stats["critical_path"]],
+    "blocked":[dict(group_summary(gid), 
+        dependency_stage=blocked[0]["stage"], stage=placed_stage[gid], 
+        slack=stats["slack"][gid], blocked_by=blocked) 
+      for gid, blocked in stats["blocked"].items()],
+    "timing":stats["timing"]
+  }
+
+def export_graph(graph_fn, dg, groups, analysis):
+  import networkx as nx
+  node_attrs = {gid:{
+      "statements":len(groups[gid].statements), 
+      "earliest":analysis.earliest[gid], 
+      "latest":analysis.latest[gid], 
+      "slack":analysis.slack[gid]
+    } for gid in dg.gids}
+  nx.write_graphml(dg.to_networkx(node_attrs), graph_fn)
+  print (f"wrote dependency graph to {graph_fn}")
+
+def write_report(report_fn, json_report):
+  with open(report_fn, "w") as f:
+    json.dump(json_report, f, indent=2)
+  print (f"wrote layout report to {report_fn}")
+
+
+#### caching ####
+# dataflow graphs are cached by the hash of everything that goes into 
+# compiling them, and layout reports by the hash of the dataflow graph, 
+# the resource model and this script. The latest placement of each source 
+# file is also kept, to warm-start the layout after small edits (--warm-start).
+
+def default_cache_dir():
+  return os.path.join(os.path.expanduser("~"), ".cache", "lucid", "layout")
+
+def hash_files(tagged_fns, extra=b""):
+  h = hashlib.sha256(extra)
+  for tag, fn in tagged_fns:
+    h.update(tag.encode() + b"\0")
+    with open(fn, "rb") as f:
+      for chunk in iter(lambda: f.read(1 << 20), b""):
+        h.update(chunk)
+  return h.hexdigest()
+
+def source_files(infn, seen=None):
+  """ the lucid source file and all the files that it (transitively) includes """
+  seen = [] if seen is None else seen
+  infn = os.path.realpath(infn)
+  if (infn in seen or not os.path.exists(infn)):
+    return seen
+  seen.append(infn)
+  src = open(infn, "r", errors="replace").read()
+  for inc in re.findall(r'^\s*include\s+"(.*?)"', src, re.MULTILINE):
+    source_files(os.path.join(os.path.dirname(infn), inc), seen)
+  return seen
+
+def dfg_cache_key(infn, symb):
+  tagged_fns = [("compiler", os.path.realpath(f"{script_dir}/dfgCompiler"))]
+  tagged_fns += [("source", fn) for fn in source_files(infn)]
+  if (symb):
+    tagged_fns.append(("symb", symb))
+  return hash_files(tagged_fns)
+
+def layout_cache_key(dfg_fn, profile, n_search, seed, hints=None):
+  """ the layout algorithm is part of the key (as the hash of this script), 
+      so that changes to it don't serve stale layouts """
+  settings = {"resources":profile, "search":n_search, "seed":seed, "hints":hints}
+  tagged_fns = [("layout", os.path.realpath(__file__)), ("dfg", dfg_fn)]
+  return hash_files(tagged_fns, json.dumps(settings, sort_keys=True).encode())
+
+def source_cache_key(infn, profile):
+  return hashlib.sha256((os.path.realpath(infn) + "\0" + profile["name"]).encode()).hexdigest()
+
+def placement_hints(pipe, groups):
+  """ group signature -> [(stage, table)] of a finished layout """
+  hints = defaultdict(list)
+  for gid, s, t in pipe.placement:
+    hints[groups[gid].signature()].append((s, t))
+  return hints
+
+class LayoutCache(object):
+  """ A directory of cached files, addressed by (kind, key) """
+  def __init__(self, cache_dir):
+    self.cache_dir = cache_dir
+
+  def path(self, kind, key):
+    return os.path.join(self.cache_dir, kind, key + ".json")
+
+  def copy_file(self, kind, key, dst_fn):
+    """ copy a cached file to dst_fn. Returns False on a miss """
+    try:
+      shutil.copyfile(self.path(kind, key), dst_fn)
+      return True
+    except OSError:
+      return False
+
+  def load(self, kind, key):
+    try:
+      with open(self.path(kind, key), "r") as f:
+        return json.load(f)
+    except (OSError, ValueError):
+      return None
+
+  def write(self, kind, key, write_fcn):
+    # write to a temporary file and rename, so that concurrent 
+    # runs never see a partially written entry
+    fn = self.path(kind, key)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    tmp_fn = "%s.%i.tmp"%(fn, os.getpid())
+    write_fcn(tmp_fn)
+    os.replace(tmp_fn, fn)
+
+  def store_file(self, kind, key, src_fn):
+    self.write(kind, key, lambda tmp_fn: shutil.copyfile(src_fn, tmp_fn))
+
+  def save(self, kind, key, obj):
+    def write_json(tmp_fn):
+      with open(tmp_fn, "w") as f:
+        json.dump(obj, f)
+    self.write(kind, key, write_json)
+
+class Tee(object):
+  """ a file-like object that writes to several others """
+  def __init__(self, *outfs):
+    self.outfs = outfs
+  def write(self, s):
+    for f in self.outfs:
+      f.write(s)
+  def flush(self):
+    for f in self.outfs:
+      f.flush()
+
+
+#### layout search ####
+# the greedy layout's result depends on the order that it places 
+# statement groups in. The search tries many different topological 
+# orders, in parallel, and keeps the one that uses the fewest stages.
+
+# each worker process (for search and batch layouts) 
+# loads its own copy of the dependency graph
+worker_graph = None
+
+def init_layout_worker(json_fn):
+  global worker_graph
+  dg, groups = build_dependency_graph(json_fn)
+  worker_graph = dg, groups, analyze_dependencies(dg)
+
+def worker_layout(profile, strategy="slack", seed=0):
+  """ returns the number of stages that one placement order uses, 
+      or None if it doesn't fit in the pipeline """
+  dg, groups, analysis = worker_graph
+  pipe = place_groups(dg, groups, placement_order(dg, analysis, strategy, seed), profile)
+  if (pipe is None):
+    return None
+  return pipe.n_stages_used()
+
+def search_layout(json_fn, dg, analysis, profile, n_trials, n_jobs=None, seed=0):
+  """ lay out the program with n_trials different placement orders, 
+      spread across n_jobs processes. Reports the distribution of 
+      stage counts and returns the best order. """
+  trials = [("slack", seed), ("topological", seed)]
+  trials += [(["random", "height"][i % 2], seed+i) for i in range(2, n_trials)]
+  print (f"**** searching {len(trials)} placement orders ****")
+  with ProcessPoolExecutor(n_jobs, initializer=init_layout_worker, initargs=(json_fn,)) as pool:
+    strategies, seeds = zip(*trials)
+    results = list(pool.map(worker_layout, [profile]*len(trials), strategies, seeds))
+  dist = defaultdict(Counter) # strategy -> number of stages -> number of trials
+  for (strategy, _), n_stages in zip(trials, results):
+    dist[strategy][n_stages] += 1
+  for strategy, counts in dist.items():
+    summary = ", ".join(["%s stages: %i"%(n if n is not None else "no fit", c)
+      for n, c in sorted(counts.items(), key=lambda nc: (nc[0] is None, nc[0] or 0))])
+    print (f"{strategy} : {summary}")
+  fits = [(n_stages, i) for i, n_stages in enumerate(results) if n_stages is not None]
+  if (fits == []):
+    print ("no placement order fit in the pipeline")
+    return None
+  n_stages, best = min(fits)
+  print (f"best placement order: {trials[best][0]} (seed {trials[best][1]}) -- {n_stages} stages")
+  return placement_order(dg, analysis, *trials[best])
+
+
+#### batch layout ####
+def layout_summary(dfg_fn, profile):
+  """ lay out a dataflow graph quietly and summarize the result """
+  start = time.perf_counter()
+  dg, groups = build_dependency_graph(dfg_fn)
+  analysis = analyze_dependencies(dg)
+  pipe = place_groups(dg, groups, placement_order(dg, analysis), profile)
+  return {
+    "statements":sum([len(sg.statements) for sg in groups.values()]),
+    "groups":len(groups),
+    "dependency_stages":analysis.n_stages,
+    "stages":pipe.n_stages_used() if pipe else None,
+    "time":time.perf_counter() - start
+  }
+
+def layout_directory(dirname, profile, cache, n_jobs=None):
+  """ compile every lucid program in dirname to a dataflow graph concurrently, 
+      lay them all out in a process pool, and print a summary table. Dataflow 
+      graphs and summaries are reused from the cache when nothing has changed. """
+  programs = sorted([fn for fn in os.listdir(dirname) if fn.endswith(".dpt")])
+  print (f"**** compiling {len(programs)} programs in {dirname} ****")
+  def compile_program(fn):
+    infn = os.path.join(dirname, fn)
+    symb = os.path.splitext(infn)[0] + ".symb"
+    return compile_dfg(infn, symb if os.path.exists(symb) else None, infn + ".layout.json", cache, quiet=True)
+  # the compiler runs in subprocesses, so threads are enough
+  with ThreadPoolExecutor(n_jobs or os.cpu_count()) as pool:
+    compiled = dict(zip(programs, pool.map(compile_program, programs)))
+
+  print (f"**** laying out with {profile['name']} ****")
+  summaries, todo = {}, []
+  for fn, (success, _) in compiled.items():
+    if (not success):
+      continue
+    dfg_fn = os.path.join(dirname, fn) + ".layout.json"
+    key = layout_cache_key(dfg_fn, profile, 0, 0)
+    summaries[fn] = cache.load("summary", key) if cache else None
+    if (summaries[fn] is None):
+      todo.append((fn, dfg_fn, key))
+  layout_errors = {}
+  with ProcessPoolExecutor(n_jobs) as pool:
+    futures = [pool.submit(layout_summary, dfg_fn, profile) for (_, dfg_fn, _) in todo]
+    for (fn, dfg_fn, key), future in zip(todo, futures):
+      try:
+        summaries[fn] = future.result()
+      except Exception as e:
+        # one bad dataflow graph shouldn't lose the whole table
+        log_fn = dfg_fn + ".error.log"
+        with open(log_fn, "w") as logf:
+          logf.write("".join(traceback.format_exception(type(e), e, e.__traceback__)))
+        layout_errors[fn] = f"{fn}: {type(e).__name__}: {e} (see {log_fn})"
+        continue
+      if (cache):
+        cache.save("summary", key, summaries[fn])
+
+  laid_out = set([t[0] for t in todo])
+  columns = ["program", "statements", "groups", "dep. stages", "stages", "dfg", "layout time"]
+  rows, errors = [], []
+  for fn in programs:
+    success, dfg_cached = compiled[fn]
+    if (not success):
+      rows.append([fn, "-", "-", "-", "-", "error", "-"])
+      errors.append(f"{fn}: see {os.path.join(dirname, fn)}.layout.json.log")
+      continue
+    if (fn in layout_errors):
+      rows.append([fn, "-", "-", "-", "-", "cached" if dfg_cached else "compiled", "error"])
+      errors.append(layout_errors[fn])
+      continue
+    summary = summaries[fn]
+    stages = "no fit" if summary["stages"] is None else "%i / %i"%(summary["stages"], profile["n_stages"])
+    layout_time = "%.2fs"%summary["time"] if fn in laid_out else "cached"
+    rows.append([fn, str(summary["statements"]), str(summary["groups"]), str(summary["dependency_stages"]), 
+      stages, "cached" if dfg_cached else "compiled", layout_time])
+  widths = [max([len(c)] + [len(r[i]) for r in rows]) for i, c in enumerate(columns)]
+  for row in [columns] + rows:
+    print ("  ".join([v.ljust(w) for v, w in zip(row, widths)]).rstrip())
+  if (errors):
+    print ("errors:\n  " + "\n  ".join(errors))
+  return summaries
+
+def layout_profiles(json_fn, profiles, n_jobs=None):
+  """ lay out the program against several resource profiles 
+      concurrently and print a summary of the results """
+  print (f"**** laying out {json_fn} with {len(profiles)} resource profiles ****")
+  with ProcessPoolExecutor(n_jobs, initializer=init_layout_worker, initargs=(json_fn,)) as pool:
+    results = list(pool.map(worker_layout, profiles))
+  name_width = max([len(p["name"]) for p in profiles] + [len("profile")])
+  print ("%s  stages used  fits"%("profile".ljust(name_width)))
+  for profile, n_stages in zip(profiles, results):
+    if (n_stages is None):
+      used, fits = "-", "no"
+    else:
+      used, fits = "%i / %i"%(n_stages, profile["n_stages"]), "yes"
+    print ("%s  %s  %s"%(profile["name"].ljust(name_width), used.ljust(len("stages used")), fits))
+  return results
+
 if __name__ == '__main__':
   main()
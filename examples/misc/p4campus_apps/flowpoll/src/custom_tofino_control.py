@@ -1,15 +1,12 @@
 import time
-def array_get(ctlmgr, arr, idx):
-  # wrap the controldriver.py array_get function to not require indices
-  res = ctlmgr.array_get(arr, [idx])
-  return res[0]
 
 def poll_flowtable(ctlmgr, flow_ids, flow_cts, tbllen, pipe_id=1):
+  # read both arrays in bulk (one hardware sync each) and keep pipe_id's copy
+  fids = ctlmgr.array_get_range(flow_ids, 0, tbllen)[0][pipe_id]
+  cts = ctlmgr.array_get_range(flow_cts, 0, tbllen)[0][pipe_id]
   flowtable = []
   for i in (range(0, tbllen)):
-    fid = array_get(ctlmgr, flow_ids, i)[pipe_id]
-    ct = array_get(ctlmgr, flow_cts, i)[pipe_id]
-    flowtable.append((i, fid, ct))
+    flowtable.append((i, int(fids[i]), int(cts[i])))
   return flowtable
 
 def print_flowtable(flowtable):
@@ -29,4 +26,3 @@ def lucid_ctl(ctlmgr, globals_dict):
     print_flowtable(flowtable)
     time.sleep(1)
 
-  
\ No newline at end of file
@@ -1,6 +1,13 @@
 from ctypes import *
 from pathlib import Path
-import json
+import json, threading, hashlib, os, time, heapq, struct, bisect, functools, atexit
+from collections import namedtuple, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor
+try:
+  import numpy as np
+except ImportError:
+  np = None
 
 DEBUG=False
 
@@ -27,6 +34,16 @@ DEBUG=False
 # 3/20/23: all keys are strings, get entry method, array set and get functions in Controller
 # 3/21/23: table_install and table_get functions in Controller
 # 4/26/23: added pktgen support, boolean fields
+# 10/18/26: batched entry installation (add_entries, table_install_many)
+# 10/18/26: bulk register reads (array_get_range, array_dump)
+# 10/18/26: per-table field codecs compiled at load time (compile_codecs)
+# 10/18/26: byte and array conversions without per-byte python loops
+# 10/18/26: tables are loaded lazily, with an optional metadata cache
+# 10/18/26: background register polling (ArrayPoller, Controller.start_polling)
+# 10/18/26: incremental array snapshots (array_get_changes, DeltaLog)
+# 10/18/26: installed entries indexed by key, batched cleanup, table_reconcile
+# 10/18/26: add_multicast_groups installs many groups in one batch
+# 10/18/26: opt-in latency profiling of driver calls and table operations
 
 # helper for globals.json: given a node from globals.json, resolve 
 # name of a lucid global to a P4 object
@@ -69,11 +86,17 @@ class Controller(object):
       loads the tables of the program, 
       and provides methods to do common 
       modifications, e.g., adding rules, mc groups, etc """
-  def __init__(self, clib_driver_obj_fn):
+  def __init__(self, clib_driver_obj_fn, metadata_cache_dir=None, bfrt_json_fn=None, profile=False):
+    """ metadata_cache_dir : if set, table definitions are saved there, 
+          so that later controllers for the same program skip introspection.
+        bfrt_json_fn : the program's bfrt.json, used to key the cache. 
+          The cache is only used when it is given. 
+        profile : if True, record latencies of driver calls and table 
+          operations (see profile_report). """
     if (clib_driver_obj_fn == None):
       raise (ValueError("error finding driver library .so file")) 
       return
-    self.libc = LibcInterface(clib_driver_obj_fn)
+    self.libc = LibcInterface(clib_driver_obj_fn, metadata_cache_dir, bfrt_json_fn, profile)
     prognames = list(self.libc.progs.keys())
     self.next_mc_node_id = 1
     if (len(prognames) == 0):
@@ -83,48 +106,122 @@ class Controller(object):
     self.progname = prognames[0]
     self.tables = self.libc.progs[self.progname]
 
-    # handles that should be destroyed on cleanup.
-    # (table, entry_hdl pairs)
-    self.installed_entries = []
+    # entries that should be deleted on cleanup, by table name. 
+    # each table maps normalized key bytes -> (key, action_id, args)
+    self.installed_entries = {}
 
     self.pktgen_app_hdl = None
 
+    # most recent dump of each array read by array_get_changes
+    self.array_snapshots = {}
+
   def cleanup(self):
-    dprint ("deleting {0} entries".format(len(self.installed_entries)))
-    for (tbl, key_hdl) in self.installed_entries:
-      dprint ("deleting entry from table: {0}".format(tbl.name))
-      tbl.del_entry(key_hdl)
+    """ delete all the entries installed by this controller, with one batch per table """
+    dprint ("deleting {0} entries".format(sum([len(entries) for entries in self.installed_entries.values()])))
+    # delete from the most recently used table first, e.g., 
+    # multicast groups before the nodes that they reference
+    for tbl_name, entries in reversed(list(self.installed_entries.items())):
+      dprint ("deleting {0} entries from table: {1}".format(len(entries), tbl_name))
+      self.tables[tbl_name].del_entries([key for (key, _, _) in entries.values()])
+    self.installed_entries = {}
+
+  def install_entry(self, tbl, key, action_id, args):
+    """ add an entry to tbl and track it if the add succeeded """
+    # normalizing validates the key, so a bad key fails before it is written
+    nkey = tbl.normalize_key(key)
+    key_hdl = tbl.add_entry(key, action_id, args, ret_hdl=True)
+    if (key_hdl != None):
+      self.libc.table_key_deallocate(key_hdl)
+      self.track_entry(tbl, key, action_id, args, nkey)
+
+  def track_entry(self, tbl, key, action_id, args, nkey=None):
+    """ remember an installed entry, so that cleanup and table_reconcile know about it """
+    if (nkey == None):
+      nkey = tbl.normalize_key(key)
+    tbl_entries = self.installed_entries.setdefault(tbl.name, {})
+    tbl_entries[nkey] = (key, action_id, tbl.normalize_args(action_id, args))
+
+  def profile_report(self, fmt="json"):
+    """ latency histograms of driver calls and table operations, 
+        as a json string (fmt="json") or prometheus text (fmt="prometheus"). 
+        The controller must have been created with profile=True. """
+    if (self.libc.profile == None):
+      raise ValueError("profiling is not enabled, create the Controller with profile=True")
+    if (fmt == "json"):
+      return json.dumps(self.libc.profile.to_dict(), indent=2)
+    elif (fmt == "prometheus"):
+      return self.libc.profile.to_prometheus()
+    raise ValueError("unknown profile report format: %s"%(fmt))
+
   def close(self):
+    self.libc.save_metadata_caches()
     self.libc.close_session()    
 
 
 
 
+  def alloc_mc_node_ids(self, n):
+    """ reserve n consecutive multicast node ids """
+    node_ids = list(range(self.next_mc_node_id, self.next_mc_node_id + n))
+    self.next_mc_node_id += n
+    return node_ids
+
+  def multicast_group_entries(self, mc_gid, ports_rids, node_ids):
+    """ the $pre.node entries and the $pre.mgid entry of a multicast group """
+    node_entries = [({'$MULTICAST_NODE_ID':node_id}, None, {'$DEV_PORT':[port], '$MULTICAST_RID':rid}) 
+      for (node_id, (port, rid)) in zip(node_ids, ports_rids)]
+    ports = [port for (port, _) in ports_rids]
+    mc_entry = ({'$MGID':mc_gid}, None, 
+      {'$MULTICAST_NODE_ID':node_ids,
+      #  '$MULTICAST_NODE_L1_XID':[0 for i in ports_rids],
+      #  '$MULTICAST_NODE_L1_XID_VALID':[False for i in ports_rids]}
+       '$MULTICAST_NODE_L1_XID':ports,
+       '$MULTICAST_NODE_L1_XID_VALID':[True for i in ports]})
+    return node_entries, mc_entry
+
   def add_multicast_group(self, mc_gid, ports_rids):
     """Add a basic multicast group that clones to all (port, rid) in ports_rids"""
     print ("[add_multicast_group] adding mc group: {0}--> [{1}]".format(str(mc_gid), str(ports_rids)))
     node_tbl = self.tables['$pre.node']
-    node_ids = []
-    ports = []
-    for i, (port, rid) in enumerate(ports_rids):    
-      ports.append(port)
-      node_id = self.next_mc_node_id
-      node_ids.append(node_id)
-      self.next_mc_node_id += 1
-      key_hdl = node_tbl.add_entry(
-        {'$MULTICAST_NODE_ID':node_id}, None,
-        {'$DEV_PORT':[port], '$MULTICAST_RID':rid}, ret_hdl=True)
-      self.installed_entries.append((node_tbl, key_hdl))
+    node_ids = self.alloc_mc_node_ids(len(ports_rids))
+    node_entries, mc_entry = self.multicast_group_entries(mc_gid, ports_rids, node_ids)
+    for node_entry in node_entries:
+      self.install_entry(node_tbl, *node_entry)
     mc_tbl = self.tables['$pre.mgid']
-    key_hdl = mc_tbl.add_entry({'$MGID':mc_gid}, None,
-      {'$MULTICAST_NODE_ID':node_ids,
-      #  '$MULTICAST_NODE_L1_XID':[0 for i in ports_rids],
-      #  '$MULTICAST_NODE_L1_XID_VALID':[False for i in ports_rids]}, ret_hdl=True)
-       '$MULTICAST_NODE_L1_XID':ports,
-       '$MULTICAST_NODE_L1_XID_VALID':[True for i in ports]}, ret_hdl=True)
-    self.installed_entries.append((mc_tbl, key_hdl))
+    self.install_entry(mc_tbl, *mc_entry)
     print ("[add_multicast_group] done")
 
+  def add_multicast_groups(self, groups):
+    """Add many multicast groups in a single session batch. 
+       groups is a list of (mc_gid, ports_rids), as in add_multicast_group. 
+       Returns a list of (position, entry, reason) for failed node and group entries."""
+    start = time.monotonic()
+    node_tbl = self.tables['$pre.node']
+    mc_tbl = self.tables['$pre.mgid']
+    node_ids = self.alloc_mc_node_ids(sum([len(ports_rids) for (_, ports_rids) in groups]))
+    all_node_entries, mc_entries = [], []
+    for (mc_gid, ports_rids) in groups:
+      group_node_ids = node_ids[len(all_node_entries):len(all_node_entries) + len(ports_rids)]
+      node_entries, mc_entry = self.multicast_group_entries(mc_gid, ports_rids, group_node_ids)
+      all_node_entries += node_entries
+      mc_entries.append(mc_entry)
+    # nodes must be added before the groups that reference them, 
+    # which the batch preserves
+    self.libc.begin_batch()
+    try:
+      node_failures = node_tbl.add_entries(all_node_entries, batch=False)
+      mc_failures = mc_tbl.add_entries(mc_entries, batch=False)
+    finally:
+      self.libc.end_batch()
+    for (tbl, entries, failures) in [(node_tbl, all_node_entries, node_failures), (mc_tbl, mc_entries, mc_failures)]:
+      failed = set([pos for (pos, _, _) in failures])
+      for pos, entry in enumerate(entries):
+        if (pos not in failed):
+          self.track_entry(tbl, *entry)
+    print ("[add_multicast_groups] added {0} groups ({1} nodes) in {2:.1f} ms, {3} failed entries".format(
+      len(groups), len(all_node_entries), (time.monotonic() - start) * 1000, len(node_failures) + len(mc_failures)))
+    return node_failures + mc_failures
+
   def array_set(self, array_id, idx, val): 
     """ set array_id[idx] = val, for all pipes. array_id must 
         be the fully qualified array name, i.e., as defined in the 
@@ -144,10 +241,110 @@ class Controller(object):
     vals = list(vals.values())
     return vals
 
+  def array_get_range(self, array_id, start, end, sync=True):
+    """ get array_id[start:end] from all pipes. The register is synced 
+        from hardware once (if sync=True) and then read in bulk from 
+        the driver. Return value is a list with one numpy array per 
+        register field, indexed as [pipe, idx - start] (without numpy, 
+        a list of per-pipe lists, indexed as [pipe][idx - start]). """
+    arr = self.tables[array_id]
+    if (sync):
+      arr.sync_registers()
+    return arr.read_register_range(start, end, from_hw=False)
+
+  def array_dump(self, array_id, sync=True):
+    """ get every cell of array_id from all pipes. See array_get_range. """
+    arr = self.tables[array_id]
+    return self.array_get_range(array_id, 0, arr.size(), sync)
+
+  def array_get_changes(self, array_id, sync=True, delta_log=None):
+    """ dump array_id and compare it to the dump from the previous call. 
+        Returns a list with one (indices, values) pair per register field, 
+        where indices are the cells that changed in any pipe and 
+        values[pipe, i] is the new value of cell indices[i]. 
+        The first call for an array reports every cell. 
+        If delta_log is a DeltaLog, the changes are also appended to it. """
+    current = self.array_dump(array_id, sync)
+    previous = self.array_snapshots.get(array_id, None)
+    self.array_snapshots[array_id] = current
+    deltas = []
+    for field_idx, cur in enumerate(current):
+      if (previous == None or previous[field_idx].shape != cur.shape):
+        changed = np.arange(cur.shape[1])
+      else:
+        changed = np.flatnonzero((cur != previous[field_idx]).any(axis=0))
+      deltas.append((changed, cur[:, changed]))
+    if (delta_log != None):
+      delta_log.append(deltas)
+    return deltas
+
   def table_install(self, table_id, key, action_id, args):
-    """ Install an entry into a table. Return the entry handle for deletion. """
+    """ Install an entry into a table. The entry is deleted by cleanup. """
+    self.install_entry(self.tables[table_id], key, action_id, args)
+
+  def table_install_many(self, table_id, entries):
+    """ Install a list of (key, action_id, args) entries into a table 
+        in a single session batch. Returns a list of 
+        (position, entry, reason) for the entries that failed. """
+    tbl = self.tables[table_id]
+    # validate every key before writing any entry
+    nkeys = [tbl.normalize_key(key) for (key, _, _) in entries]
+    failures = tbl.add_entries(entries)
+    dprint ("[table_install_many] %s: %i entries, %i failed"%(table_id, len(entries), len(failures)))
+    failed = set([pos for (pos, _, _) in failures])
+    for pos, (key, action_id, args) in enumerate(entries):
+      if (pos not in failed):
+        self.track_entry(tbl, key, action_id, args, nkeys[pos])
+    return failures
+
+  def table_clear(self, table_id):
+    """ delete every entry of a table, including entries 
+        that were not installed by this controller """
+    self.tables[table_id].clear()
+    self.installed_entries.pop(table_id, None)
+
+  def table_reconcile(self, table_id, entries):
+    """ make a table contain exactly entries, a list of (key, action_id, args). 
+        Only the difference from the installed entries is written: 
+        new keys are added, keys with a different action or args are modified, 
+        and keys that are not in entries are deleted. If this controller has 
+        not installed anything in the table yet, the installed entries are read 
+        from the device, so a restarted controller does not reinstall the table. 
+        Returns a dict of failure lists (see add_entries) for "add", "mod" and "del". """
     tbl = self.tables[table_id]
-    tbl.add_entry(key, action_id, args)
+    if (table_id not in self.installed_entries):
+      for (key, action_id, args) in tbl.read_entries():
+        self.track_entry(tbl, key, action_id, args)
+    current = self.installed_entries.get(table_id, {})
+    desired = {}
+    for (key, action_id, args) in entries:
+      desired[tbl.normalize_key(key)] = (key, action_id, tbl.normalize_args(action_id, args))
+    def unchanged(nkey):
+      _, cur_action, cur_args = current[nkey]
+      _, new_action, new_args = desired[nkey]
+      # a field that only one of the entries has is a change
+      return (cur_action == new_action and 
+        set(cur_args) == set(new_args) and
+        all([same_field_value(new_args[name], val) for name, val in cur_args.items()]))
+    adds = [nkey for nkey in desired if nkey not in current]
+    mods = [nkey for nkey in desired if nkey in current and not unchanged(nkey)]
+    dels = [nkey for nkey in current if nkey not in desired]
+    dprint ("[table_reconcile] %s: %i adds, %i mods, %i dels"%(table_id, len(adds), len(mods), len(dels)))
+    failures = {
+      "del":tbl.del_entries([current[nkey][0] for nkey in dels]),
+      "mod":tbl.mod_entries([desired[nkey] for nkey in mods]),
+      "add":tbl.add_entries([desired[nkey] for nkey in adds])
+    }
+    # the tracked entries are now the desired entries, except where an operation failed
+    new_entries = dict(desired)
+    for pos, _, _ in failures["add"]:
+      del new_entries[adds[pos]]
+    for pos, _, _ in failures["mod"]:
+      new_entries[mods[pos]] = current[mods[pos]]
+    for pos, _, _ in failures["del"]:
+      new_entries[dels[pos]] = current[dels[pos]]
+    self.installed_entries[table_id] = new_entries
+    return failures
 
   def table_get(self, table_id, key):
     """ Get the action associated with a key in a table """
@@ -216,22 +413,341 @@ class Controller(object):
     app_cfg_acn_params = {"app_enable":False}
     app_cfg_tbl.add_entry(app_cfg_key, "trigger_timer_periodic", app_cfg_acn_params)
 
+  ### background polling
+  def start_polling(self, arrays, callback=None, pipes=None, n_workers=4, ring_size=64):
+    """ start polling register arrays in the background. 
+        arrays : dict array_id -> polling interval in seconds
+        callback : called with each Snapshot, off of the polling threads
+        pipes : list of pipe ids to read separately (None reads all pipes at once)
+        Returns the running ArrayPoller; call its stop method when done. """
+    poller = ArrayPoller(self, arrays, pipes, n_workers, ring_size)
+    if (callback != None):
+      poller.subscribe(callback)
+    poller.start()
+    return poller
+
+# A register array read by the poller. values is the list 
+# returned by Controller.array_get_range for the whole array. 
+# pipe is None if the read targeted all pipes.
+Snapshot = namedtuple("Snapshot", "seq array_id pipe timestamp duration values")
+
+class SnapshotRing(object):
+  """ A bounded buffer of the most recent snapshots. 
+      Writers never block: when the ring is full, the oldest snapshot is dropped. """
+  def __init__(self, capacity):
+    self.snapshots = deque(maxlen=capacity)
+    self.next_seq = 0
+    self.cond = threading.Condition()
+
+  def push(self, array_id, pipe, timestamp, duration, values):
+    with self.cond:
+      snap = Snapshot(self.next_seq, array_id, pipe, timestamp, duration, values)
+      self.next_seq += 1
+      self.snapshots.append(snap)
+      self.cond.notify_all()
+    return snap
+
+  def read_since(self, seq, timeout=None):
+    """ wait up to timeout for snapshots numbered seq or later. 
+        Returns (snapshots, number of snapshots since seq that were dropped) """
+    with self.cond:
+      if (self.next_seq <= seq):
+        self.cond.wait(timeout)
+      snaps = [snap for snap in self.snapshots if snap.seq >= seq]
+      first_seq = snaps[0].seq if snaps else self.next_seq
+      return snaps, max(0, first_seq - seq)
+
+  def latest(self, array_id, pipe=None):
+    """ the most recent snapshot of array_id from pipe, or None """
+    with self.cond:
+      for snap in reversed(self.snapshots):
+        if (snap.array_id == array_id and snap.pipe == pipe):
+          return snap
+    return None
+
+class ArrayPoller(object):
+  """ Reads register arrays on fixed intervals in background threads. 
+      A scheduler thread submits reads to a thread pool; each worker uses 
+      its own session for each pipe. Snapshots go into a SnapshotRing, 
+      and subscribed callbacks run on a separate dispatch thread, 
+      so slow callbacks do not delay reads. """
+  def __init__(self, controller, arrays, pipes=None, n_workers=4, ring_size=64):
+    if (not arrays):
+      raise ValueError("ArrayPoller needs at least one array to poll")
+    self.controller = controller
+    self.arrays = arrays
+    self.pipes = pipes if pipes != None else [None]
+    self.n_workers = n_workers
+    self.ring = SnapshotRing(ring_size)
+    self.callbacks = []
+    # (array_id, pipe) reads that were skipped because the last read was still running
+    self.overruns = {}
+    self.dropped = 0
+    self._in_flight = set()
+    self._sessions = []
+    # ids of the worker threads, whose bulk read handles are freed by stop
+    self._worker_threads = set()
+    self._worker_state = threading.local()
+    self._lock = threading.Lock()
+    self._stopped = threading.Event()
+    self._threads = []
+    self._pool = None
+
+  def subscribe(self, callback):
+    """ call callback(snapshot) for every snapshot taken from now on """
+    self.callbacks.append(callback)
+
+  def start(self):
+    self._stopped.clear()
+    self._pool = ThreadPoolExecutor(max_workers=self.n_workers)
+    self._threads = [
+      threading.Thread(target=self._schedule, daemon=True),
+      threading.Thread(target=self._dispatch, daemon=True)]
+    for t in self._threads:
+      t.start()
+
+  def stop(self):
+    """ stop polling, wait for running reads, and close the worker 
+        sessions and free their bulk read handles """
+    self._stopped.set()
+    with self.ring.cond:
+      self.ring.cond.notify_all()
+    for t in self._threads:
+      t.join()
+    self._pool.shutdown(wait=True)
+    for array_id in self.arrays:
+      self.controller.tables[array_id].release_bulk_handles(self._worker_threads)
+    self._worker_threads = set()
+    for session in self._sessions:
+      self.controller.libc.destroy_session(session)
+    self._sessions = []
+
+  def latest(self, array_id, pipe=None):
+    return self.ring.latest(array_id, pipe)
+
+  def _schedule(self):
+    now = time.monotonic()
+    due = [(now, array_id, pipe) for array_id in self.arrays for pipe in self.pipes]
+    heapq.heapify(due)
+    while (not self._stopped.is_set()):
+      next_time, array_id, pipe = due[0]
+      if (self._stopped.wait(max(0, next_time - time.monotonic()))):
+        break
+      heapq.heappop(due)
+      with self._lock:
+        busy = (array_id, pipe) in self._in_flight
+        if (busy):
+          self.overruns[(array_id, pipe)] = self.overruns.get((array_id, pipe), 0) + 1
+        else:
+          self._in_flight.add((array_id, pipe))
+      if (not busy):
+        self._pool.submit(self._read, array_id, pipe)
+      # keep a fixed cadence, but don't try to catch up after falling behind
+      next_time = max(next_time + self.arrays[array_id], time.monotonic())
+      heapq.heappush(due, (next_time, array_id, pipe))
+
+  def _bind_session(self, pipe):
+    """ bind the calling worker thread to its session for pipe """
+    sessions = self._worker_state.__dict__
+    if (pipe not in sessions):
+      session = self.controller.libc.create_session()
+      with self._lock:
+        self._sessions.append(session)
+        self._worker_threads.add(threading.get_ident())
+      sessions[pipe] = session
+    self.controller.libc.bind_thread(sessions[pipe], 0xFFFF if pipe == None else pipe)
+
+  def _read(self, array_id, pipe):
+    try:
+      self._bind_session(pipe)
+      timestamp = time.time()
+      start = time.monotonic()
+      values = self.controller.array_dump(array_id)
+      self.ring.push(array_id, pipe, timestamp, time.monotonic() - start, values)
+    except Exception as e:
+      print ("WARNING: polling %s (pipe %s) failed: %s"%(array_id, pipe, e))
+    finally:
+      with self._lock:
+        self._in_flight.discard((array_id, pipe))
+
+  def _dispatch(self):
+    seq = self.ring.next_seq
+    while (not self._stopped.is_set()):
+      snaps, dropped = self.ring.read_since(seq, timeout=0.5)
+      if (dropped):
+        self.dropped += dropped
+        dprint ("[ArrayPoller] callbacks fell behind, %i snapshots dropped"%(dropped))
+      for snap in snaps:
+        for callback in self.callbacks:
+          try:
+            callback(snap)
+          except Exception as e:
+            print ("WARNING: polling callback failed: %s"%(e))
+        seq = snap.seq + 1
+
+# record header in a DeltaLog file: 
+# timestamp, field index, number of pipes, number of changed cells
+DELTA_RECORD_HEADER = struct.Struct("<dIIQ")
+DeltaRecord = namedtuple("DeltaRecord", "timestamp field indices values")
+
+class DeltaLog(object):
+  """ An append-only file of array deltas from Controller.array_get_changes. 
+      Each record is a DELTA_RECORD_HEADER followed by the changed indices and 
+      then the new values (one row per pipe), all as little-endian uint64s. 
+      Every part is 8-byte aligned, so read_delta_log can memory-map the file. """
+  def __init__(self, fn):
+    self.fn = fn
+    self.f = open(fn, "ab")
+
+  def append(self, deltas, timestamp=None):
+    if (timestamp == None):
+      timestamp = time.time()
+    for field_idx, (indices, values) in enumerate(deltas):
+      self.f.write(DELTA_RECORD_HEADER.pack(timestamp, field_idx, values.shape[0], len(indices)))
+      self.f.write(np.ascontiguousarray(indices, dtype="<u8").tobytes())
+      self.f.write(np.ascontiguousarray(values, dtype="<u8").tobytes())
+    self.f.flush()
+
+  def close(self):
+    self.f.close()
+
+def read_delta_log(fn):
+  """ iterate over the DeltaRecords in a DeltaLog file. The indices and 
+      values arrays of each record are views into a memory map of the file. """
+  if (os.path.getsize(fn) == 0):
+    return
+  buf = np.memmap(fn, dtype=np.uint8, mode="r")
+  pos = 0
+  while (pos + DELTA_RECORD_HEADER.size <= len(buf)):
+    timestamp, field_idx, n_pipes, n_changed = DELTA_RECORD_HEADER.unpack_from(buf, pos)
+    pos += DELTA_RECORD_HEADER.size
+    end = pos + 8 * n_changed * (n_pipes + 1)
+    # a partially written last record
+    if (end > len(buf)):
+      return
+    indices = buf[pos:pos + 8 * n_changed].view("<u8")
+    values = buf[pos + 8 * n_changed:end].view("<u8").reshape(n_pipes, n_changed)
+    pos = end
+    yield DeltaRecord(timestamp, field_idx, indices, values)
+
+# upper bounds (in seconds) of the latency histogram buckets
+PROFILE_BUCKETS = (1e-6, 2.5e-6, 5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 
+  1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0)
+
+class LatencyHistogram(object):
+  def __init__(self):
+    self.count = 0
+    self.total = 0.0
+    # the last bucket is +Inf
+    self.buckets = [0] * (len(PROFILE_BUCKETS) + 1)
+
+  def record(self, seconds):
+    self.count += 1
+    self.total += seconds
+    self.buckets[bisect.bisect_left(PROFILE_BUCKETS, seconds)] += 1
+
+  def to_dict(self):
+    return {"count":self.count, "sum_seconds":self.total, 
+      "buckets":{str(le):n for le, n in zip(PROFILE_BUCKETS + ("+Inf",), self.buckets)}}
+
+class DriverProfile(object):
+  """ Latency histograms for driver functions (C time only) and for 
+      table operations (total time, including python-side marshaling). """
+  def __init__(self):
+    self.driver_calls = {} # function name -> histogram
+    self.table_ops = {} # (table name, op) -> histogram
+    self.lock = threading.Lock()
+
+  def record_call(self, fname, seconds):
+    with self.lock:
+      self.driver_calls.setdefault(fname, LatencyHistogram()).record(seconds)
+
+  def record_table_op(self, table, op, seconds):
+    with self.lock:
+      self.table_ops.setdefault((table, op), LatencyHistogram()).record(seconds)
+
+  def timed(self, fname, fcn):
+    """ wrap a driver function so that its calls are recorded """
+    def timed_fcn(*args):
+      start = time.perf_counter()
+      try:
+        return fcn(*args)
+      finally:
+        self.record_call(fname, time.perf_counter() - start)
+    return timed_fcn
+
+  def to_dict(self):
+    with self.lock:
+      tables = {}
+      for (table, op), hist in self.table_ops.items():
+        tables.setdefault(table, {})[op] = hist.to_dict()
+      return {
+        "driver_calls":{fname:hist.to_dict() for fname, hist in self.driver_calls.items()},
+        "table_ops":tables}
+
+  def to_prometheus(self):
+    lines = []
+    def histogram(metric, help_str, hists):
+      lines.append("# HELP %s %s"%(metric, help_str))
+      lines.append("# TYPE %s histogram"%(metric))
+      for labels, hist in hists:
+        label_str = ",".join(['%s="%s"'%(k, v) for k, v in labels])
+        cumulative = 0
+        for le, n in zip(PROFILE_BUCKETS + ("+Inf",), hist.buckets):
+          cumulative += n
+          lines.append('%s_bucket{%s,le="%s"} %i'%(metric, label_str, le, cumulative))
+        lines.append("%s_sum{%s} %s"%(metric, label_str, repr(float(hist.total))))
+        lines.append("%s_count{%s} %i"%(metric, label_str, hist.count))
+    with self.lock:
+      histogram("lucid_driver_call_seconds", "Latency of bf_rt driver function calls.", 
+        [([("function", fname)], hist) for fname, hist in self.driver_calls.items()])
+      histogram("lucid_table_op_seconds", "Latency of table operations, including marshaling.", 
+        [([("table", table), ("op", op)], hist) for (table, op), hist in self.table_ops.items()])
+    return "\n".join(lines) + "\n"
+
+def profiled_table_op(op):
+  """ decorator for BfRtTable methods: record the latency of 
+      the operation if the driver interface is profiling """
+  def decorate(method):
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+      profile = self._cintf.profile
+      if (profile == None):
+        return method(self, *args, **kwargs)
+      start = time.perf_counter()
+      try:
+        return method(self, *args, **kwargs)
+      finally:
+        profile.record_table_op(self.name, op, time.perf_counter() - start)
+    return wrapper
+  return decorate
+
 class BfRtTable:
     """Class to operate on tables, both defined in P4 and also 
        fixed tables. A program is just a list of named tables. """
-    def __init__(self, cintf, handle):
+    def __init__(self, cintf, handle, metadata=None):
+      """ metadata : a previous to_metadata() of this table. 
+          If given, the table definition is not loaded from the driver. """
       self._cintf = cintf
       self._handle = handle
+      # handles for bulk reads, allocated on first use by each thread: 
+      # thread id -> (n, key handles, data handles)
+      self._bulk = {}
+      self._bulk_lock = threading.Lock()
 
-      self.name = self._cintf.table_name_get(self._handle).value.decode('ascii')
-      self.bf_rt_id = self._cintf.table_id_get(self._handle).value
-      self.has_const_default_action = self._cintf.table_has_const_default_action(self._handle)
+      if (metadata != None):
+        self.load_metadata(metadata)
+      else:
+        self.name = self._cintf.table_name_get(self._handle).value.decode('ascii')
+        self.bf_rt_id = self._cintf.table_id_get(self._handle).value
+        self.has_const_default_action = self._cintf.table_has_const_default_action(self._handle).value
 
-      dprint ("TABLE %s"%(self.name))
-      ### loading table definitions ###
-      self.load_key()
-      self.load_actions()
-      self.load_data()
+        dprint ("TABLE %s"%(self.name))
+        ### loading table definitions ###
+        self.load_key()
+        self.load_actions()
+        self.load_data()
+      self.compile_codecs()
 
     def load_key(self):
       # ref: _init_key
@@ -353,114 +869,276 @@ class BfRtTable:
             self.load_data_field(action_info["data_fields"], idx, field_id, action_info["id"], action_name)
             action_info["data_fields"] = ensure_sorted(action_info["data_fields"])
 
+    def to_metadata(self):
+      """ the loaded table definition, as json-serializable objects """
+      metadata = {
+        "name":self.name,
+        "bf_rt_id":self.bf_rt_id,
+        "has_const_default_action":self.has_const_default_action,
+        "key_fields":self.key_fields,
+        "actions":self.actions,
+        "data_fields":self.data_fields
+      }
+      # some ids are stored as ctypes values
+      return json.loads(json.dumps(metadata, default=lambda cval: cval.value))
+
+    def load_metadata(self, metadata):
+      """ load the table definition from to_metadata() output """
+      def restore_annotations(data_fields):
+        # json turns the (name, value) annotation tuples into lists
+        for info in data_fields.values():
+          info["annotations"] = [tuple(ann) for ann in info["annotations"]]
+          restore_annotations(info["cont_data_fields"])
+      self.name = metadata["name"]
+      self.bf_rt_id = metadata["bf_rt_id"]
+      self.has_const_default_action = metadata["has_const_default_action"]
+      self.key_fields = metadata["key_fields"]
+      self.actions = metadata["actions"]
+      self.action_id_name_map = {info["id"]:name for name, info in self.actions.items()}
+      self.data_fields = metadata["data_fields"]
+      restore_annotations(self.data_fields)
+      for action_info in self.actions.values():
+        restore_annotations(action_info["data_fields"])
+
     ### table update helpers ###
     def create_key(self, entry):      
+      key_hdl = self._cintf.table_key_allocate(self._handle)
+      self.fill_key(key_hdl, entry)
+      return key_hdl
+
+    def fill_key(self, key_hdl, entry):
       # _set_key_fields
       dprint ("filling key")
-      key_hdl = self._cintf.table_key_allocate(self._handle)
       # if the key is a list, transform it into a dict
       if (type(entry) == list):
         # priority, the last field, is missing -- use default of 0
         if (len(entry) == len(self.key_fields) - 1):
           entry = entry + [0]
-        entry = {k:v for (k, v) in zip(self.key_fields.keys(), entry)}
-      for field_name, field_val in entry.items():
-        field_info = self.key_fields[field_name]
-        dprint (field_info["data_type"])
-        if (key_type_map(field_info["type"]) == "EXACT"):
-          if (data_type_map(field_info["data_type"]) != "String"):
-            if (not field_info["is_ptr"]):
-              dprint ("filling entry[{0}] : {1}".format(field_name, field_val))
-              self._cintf.key_field_set_value(key_hdl, field_info["id"], c_ulonglong(field_val))
-              continue
-            else:
-              print ("unexpected: key field pointer")
-          else:
-            print ("unexpected: key field is string")
-        elif (key_type_map(field_info["type"]) == "TERNARY"):
-          if (data_type_map(field_info["data_type"]) != "String"):
-            if (not field_info["is_ptr"]):
-              # default mask is 2^(size) - 1 (e.g., 0xff for an 8-bit field)
-              value, mask = 0, ((1<<field_info["size"]) - 1)
-              if (type(field_val) == tuple):
-                value, mask = field_val
-              dprint ("ternary key column: (value:%s, mask%s)"%(value, mask))
-              value = c_ulonglong(value)
-              mask = c_ulonglong(mask)
-              self._cintf.key_field_set_value_and_mask(key_hdl, field_info["id"], value, mask)
-              continue
-            else:
-              print ("unexpected: key field pointer")
-          else:
-            print ("unexpected: key field is string")
-        else:
-          # TODO: other match types
-          print ("unexpected key field type")
-      return key_hdl
+        entry = zip(self.key_setters.keys(), entry)
+      else:
+        entry = entry.items()
+      key_setters = self.key_setters
+      for field_name, field_val in entry:
+        key_setters[field_name](key_hdl, field_val)
 
     # fill all the data fields
-    def fill_data_fields(self, data_hdl, args, fields_info):
+    def fill_data_fields(self, data_hdl, args, setters):
+      """ fill data fields from args, using a setter plan from compile_data_setters """
       dprint ("[fill_data_fields] args:%s"%(str(args)))
       # args may be a list, which we transform into a dictionary
       if (type(args) == list):        
-        args = {k:v for (k, v) in zip(fields_info.keys(), args)}
-
-      for field_name, field_val in args.items():
-        field_info = fields_info[field_name]
-        data_type = data_type_map(field_info["data_type"])
-        dprint ("setting field: {0} = {1}".format(field_name, field_val))
-        if (data_type == "BYTE_STREAM"):
-          cval, n_bytes = to_c_byte_arr(field_val, field_info["size"])
-          dprint ("[fill_data_fields / BYTE_STREAM] field: {0} value: {1} n_bytes: {2}".format(field_name, cval, n_bytes))
-          self._cintf.data_field_set_value_ptr(data_hdl, field_info["id"], cval, n_bytes)
-        elif (data_type == "UINT64"):
-          if (not field_info["is_ptr"]):
-            c_value = c_ulonglong(field_val)
-            self._cintf.data_field_set_value(data_hdl, field_info["id"], c_value)
-          else:
-            value, n_bytes = self.to_c_byte_arr(field_val, field_info["size"])
-            self._cintf.data_field_set_value_ptr(data_hdl, field_info["id"], value, n_bytes)
-        elif (data_type == "INT_ARR"):
-          # handle 8-bit integer arrays as a byte stream -- 
-          # this is how bf_rt_pktgen_table_data_impl.cpp is implemented
-          if(field_info["size"] == 8):
-            if (type(field_val) == bytearray):
-              n_bytes = len(field_val)
-              value_type = c_ubyte * n_bytes
-              value = value_type()
-              for i in range(0, len(field_val)):
-                value[i] = field_val[i]
-              self._cintf.data_field_set_value_ptr(data_hdl, field_info["id"], value, n_bytes)
-            else:
-              print ("ERROR: a data field of type INT_ARR with size 8 must be a bytearray")
-              exit(1)              
-          # this seems to work correctly for 16 and 32-bit arrays. 
-          # I'm not sure why you can use c_uint as the cell type for a 16-bit array, though...
+        args = zip(setters.keys(), args)
+      else:
+        args = args.items()
+      for field_name, field_val in args:
+        if (setters[field_name](data_hdl, field_val) == False):
+          return False
+      return True
+
+    ### field codecs ###
+    # each table compiles its field metadata into plans of closures once, 
+    # so that filling or reading an entry does not re-dispatch on field types. 
+    def compile_codecs(self):
+      self.key_setters = {name:self.compile_key_setter(info) for name, info in self.key_fields.items()}
+      self.key_getters = {name:self.compile_key_getter(info) for name, info in self.key_fields.items()}
+      self.key_encoders = {name:compile_key_encoder(info) for name, info in self.key_fields.items()}
+      self.data_setters = {None:self.compile_data_setters(self.data_fields)}
+      self.data_getters = {None:self.compile_data_getters(self.data_fields)}
+      for action_name, action_info in self.actions.items():
+        self.data_setters[action_name] = self.compile_data_setters(action_info["data_fields"])
+        self.data_getters[action_name] = self.compile_data_getters(action_info["data_fields"])
+
+    def compile_key_setter(self, field_info):
+      """ build a function (key_hdl, value) -> None that sets the key field """
+      field_id = field_info["id"]
+      key_type = key_type_map(field_info["type"])
+      def unexpected(msg):
+        def setter(key_hdl, field_val):
+          print (msg)
+        return setter
+      if (key_type not in ["EXACT", "TERNARY"]):
+        # TODO: other match types
+        return unexpected("unexpected key field type")
+      if (data_type_map(field_info["data_type"]) == "String"):
+        return unexpected("unexpected: key field is string")
+      if (field_info["is_ptr"]):
+        return unexpected("unexpected: key field pointer")
+      if (key_type == "EXACT"):
+        set_value = self._cintf.key_field_set_value
+        def setter(key_hdl, field_val):
+          set_value(key_hdl, field_id, c_ulonglong(field_val))
+        return setter
+      else:
+        set_value_and_mask = self._cintf.key_field_set_value_and_mask
+        # default mask is 2^(size) - 1 (e.g., 0xff for an 8-bit field)
+        default_mask = c_ulonglong((1<<field_info["size"]) - 1)
+        def setter(key_hdl, field_val):
+          if (type(field_val) == tuple):
+            value, mask = field_val
+            set_value_and_mask(key_hdl, field_id, c_ulonglong(value), c_ulonglong(mask))
           else:
-            arrlen = len(field_val)
-            arrty = c_uint * arrlen
-            value = arrty()
-            for idx, v in enumerate(field_val):
-              value[idx] = v
-            self._cintf.data_field_set_value_array(data_hdl, field_info["id"], value, arrlen)
-        elif (data_type == "BOOL_ARR"):
-          arrlen = len(field_val)
-          arrty = c_uint * arrlen
-          value = arrty()
-          for idx, v in enumerate(field_val):
-            value[idx] = v
-          self._cintf.data_field_set_value_bool_array(data_hdl, field_info["id"], value, arrlen)
-        elif (data_type == "BOOL"):
-          c_value = c_bool(field_val)          
-          self._cintf.data_field_set_bool(data_hdl, field_info["id"], c_value)
-        elif (data_type == "STRING"):
-          c_value = c_char_p(field_val.encode('ascii'))
-          self._cintf.data_field_set_string(data_hdl, field_info["id"], c_value)
-        else:
-          # TODO: other field types 
+            set_value_and_mask(key_hdl, field_id, c_ulonglong(0), default_mask)
+        return setter
+
+    def compile_key_getter(self, field_info):
+      """ build a function key_hdl -> value that reads the key field, 
+          in the format that the key setter accepts """
+      field_id = field_info["id"]
+      if (key_type_map(field_info["type"]) == "TERNARY"):
+        get_value_and_mask = self._cintf.key_field_get_value_and_mask
+        def getter(key_hdl):
+          value, mask = c_ulonglong(0), c_ulonglong(0)
+          get_value_and_mask(key_hdl, field_id, byref(value), byref(mask))
+          return (value.value, mask.value)
+      else:
+        get_value = self._cintf.key_field_get_value
+        def getter(key_hdl):
+          value = c_ulonglong(0)
+          get_value(key_hdl, field_id, byref(value))
+          return value.value
+      return getter
+
+    def normalize_key(self, entry):
+      """ canonical bytes of a key (dict or list, as in add_entry), 
+          e.g., to index installed entries. Unset fields are 0. """
+      if (type(entry) == list):
+        entry = dict(zip(self.key_encoders.keys(), entry))
+      return b"".join([encode(entry.get(name, 0)) for name, encode in self.key_encoders.items()])
+
+    def normalize_args(self, action_name, args):
+      """ args of an entry (dict or list, as in add_entry) as a dict """
+      if (type(args) == list):
+        return dict(zip(self.data_setters[action_name].keys(), args))
+      return dict(args)
+
+    def compile_data_setters(self, fields_info):
+      """ build an ordered dict of field name -> function (data_hdl, value). 
+          A setter returns False if the value could not be set. """
+      return {name:self.compile_data_setter(info) for name, info in fields_info.items()}
+
+    def compile_data_setter(self, field_info):
+      cintf = self._cintf
+      field_id = field_info["id"]
+      size = field_info["size"]
+      data_type = data_type_map(field_info["data_type"])
+      if (data_type == "BYTE_STREAM" or (data_type == "UINT64" and field_info["is_ptr"])):
+        def setter(data_hdl, field_val):
+          # the driver copies the value, so a reused buffer is safe here
+          cval, n_bytes = to_c_byte_arr(field_val, size, reuse=True)
+          cintf.data_field_set_value_ptr(data_hdl, field_id, cval, n_bytes)
+      elif (data_type == "UINT64"):
+        def setter(data_hdl, field_val):
+          cintf.data_field_set_value(data_hdl, field_id, c_ulonglong(field_val))
+      elif (data_type == "INT_ARR" and size == 8):
+        # handle 8-bit integer arrays as a byte stream -- 
+        # this is how bf_rt_pktgen_table_data_impl.cpp is implemented
+        def setter(data_hdl, field_val):
+          if (type(field_val) != bytearray):
+            print ("ERROR: a data field of type INT_ARR with size 8 must be a bytearray")
+            exit(1)
+          # view the bytearray's memory directly, no copy
+          n_bytes = len(field_val)
+          value = (c_ubyte * n_bytes).from_buffer(field_val)
+          cintf.data_field_set_value_ptr(data_hdl, field_id, value, n_bytes)
+      elif (data_type == "INT_ARR"):
+        # this seems to work correctly for 16 and 32-bit arrays. 
+        # I'm not sure why you can use c_uint as the cell type for a 16-bit array, though...
+        def setter(data_hdl, field_val):
+          value, arrlen = to_c_uint_arr(field_val)
+          cintf.data_field_set_value_array(data_hdl, field_id, value, arrlen)
+      elif (data_type == "BOOL_ARR"):
+        def setter(data_hdl, field_val):
+          value, arrlen = to_c_uint_arr(field_val)
+          cintf.data_field_set_value_bool_array(data_hdl, field_id, value, arrlen)
+      elif (data_type == "BOOL"):
+        def setter(data_hdl, field_val):
+          cintf.data_field_set_bool(data_hdl, field_id, c_bool(field_val))
+      elif (data_type == "STRING"):
+        def setter(data_hdl, field_val):
+          cintf.data_field_set_string(data_hdl, field_id, c_char_p(field_val.encode('ascii')))
+      else:
+        # TODO: other field types 
+        def setter(data_hdl, field_val):
           print ("unhandled field data type: %s"%(data_type))
           return False
-      return True
+      return setter
+
+    def compile_data_getters(self, fields_info):
+      """ build a tuple of (field name, field id, function data_hdl -> value) 
+          for the readable fields in fields_info """
+      getters = []
+      for name, info in fields_info.items():
+        getter = self.compile_data_getter(info)
+        if (getter == None):
+          continue
+        getters.append((name, info["id"], getter))
+      return tuple(getters)
+
+    def compile_data_getter(self, info):
+      """ build a function data_hdl -> value that reads a data field, 
+          in the format that its setter accepts (None if unsupported) """
+      cintf = self._cintf
+      dtype = data_type_map(info["data_type"])
+      field_id, size = info["id"], info["size"]
+      if (dtype == "BYTE_STREAM" and ('$bfrt_field_class', 'register_data') in info["annotations"]):
+        # case: register read
+        def getter(data_hdl):
+          return cintf.data_field_get_value_u64_array(data_hdl, field_id)[:]
+      elif (dtype == "BYTE_STREAM" or (dtype == "UINT64" and info["is_ptr"])):
+        # case: action argument
+        def getter(data_hdl):
+          cval, n_bytes = to_c_byte_arr(0, size, reuse=True)
+          # fill val
+          cintf.data_field_get_value_ptr(data_hdl, field_id, n_bytes, cval)
+          return from_c_byte_arr(cval, size)
+      elif (dtype == "UINT64"):
+        def getter(data_hdl):
+          value = c_ulonglong(0)
+          cintf.data_field_get_value(data_hdl, field_id, byref(value))
+          return value.value
+      elif (dtype == "INT_ARR" and size == 8):
+        def getter(data_hdl):
+          return bytearray(cintf.data_field_get_value_array(data_hdl, field_id)[:])
+      elif (dtype == "INT_ARR"):
+        def getter(data_hdl):
+          return cintf.data_field_get_value_array(data_hdl, field_id)[:]
+      elif (dtype == "BOOL_ARR"):
+        def getter(data_hdl):
+          return [int(v) for v in cintf.data_field_get_value_bool_array(data_hdl, field_id)]
+      elif (dtype == "BOOL"):
+        def getter(data_hdl):
+          value = c_bool(False)
+          cintf.data_field_get_bool(data_hdl, field_id, byref(value))
+          return value.value
+      elif (dtype == "STRING"):
+        def getter(data_hdl):
+          n_chars = c_uint(0)
+          cintf.data_field_get_string_size(data_hdl, field_id, byref(n_chars))
+          value = create_string_buffer(n_chars.value + 1)
+          cintf.data_field_get_string(data_hdl, field_id, value)
+          return value.value.decode('ascii')
+      else:
+        dprint("[compile_data_getters] unsupported field type: %s"%(dtype))
+        return None
+      return getter
+
+    def allocate_data(self, action_name):
+      """ allocate a data handle for entries of action_name 
+          (or an actionless data handle if action_name is None) """
+      if (action_name != None):
+        return self._cintf.table_action_data_allocate(self._handle, self.actions[action_name]["id"])
+      return self._cintf.table_data_allocate(self._handle)
+
+    def reset_data(self, data_hdl, action_name):
+      """ clear a data handle from allocate_data so that it can be reused """
+      if (action_name != None):
+        self._cintf.table_action_data_reset(self._handle, self.actions[action_name]["id"], data_hdl)
+      else:
+        self._cintf.table_data_reset(self._handle, data_hdl)
+
+    def fill_data(self, data_hdl, action_name, args):
+      """ fill a data handle from allocate_data with args """
+      return self.fill_data_fields(data_hdl, args, self.data_setters[action_name])
 
     def create_action(self, action_name, action_args):
       """ 
@@ -471,14 +1149,14 @@ class BfRtTable:
       """
       # ref set_data_fields
       action_hdl = self._cintf.table_action_data_allocate(self._handle, self.actions[action_name]["id"])
-      succ = self.fill_data_fields(action_hdl, action_args, self.actions[action_name]["data_fields"])
+      succ = self.fill_data_fields(action_hdl, action_args, self.data_setters[action_name])
       # ref _set_data_field
       return succ, action_hdl
 
     def create_data(self, args):
       """ Create an actionless data entry """
       data_hdl = self._cintf.table_data_allocate(self._handle)
-      succ = self.fill_data_fields(data_hdl, args, self.data_fields) 
+      succ = self.fill_data_fields(data_hdl, args, self.data_setters[None])
       return succ, data_hdl
 
     def create_empty_data(self):
@@ -493,44 +1171,165 @@ class BfRtTable:
           self._cintf.get_dev_tgt(), 0, # session info + "flags"
           key_hdl, data_hdl)  
 
-    def cintf_table_get(self, key_hdl, data_hdl):
+    def cintf_table_mod(self, key_hdl, data_hdl):
+      # wrapper for table_entry_mod that includes fixed args
+      return self._cintf.table_entry_mod(
+          self._handle, 
+          self._cintf.get_session(), 
+          self._cintf.get_dev_tgt(), 0,
+          key_hdl, data_hdl)  
+
+    def cintf_table_del(self, key_hdl):
+      # wrapper for table_entry_del that includes fixed args
+      return self._cintf.table_entry_del(
+          self._handle, 
+          self._cintf.get_session(), 
+          self._cintf.get_dev_tgt(), 0,
+          key_hdl)  
+
+    def cintf_table_get(self, key_hdl, data_hdl, from_hw=True):
       # wrapper for table_entry_get that includes fixed args
       return self._cintf.table_entry_get(
           self._handle,
           self._cintf.get_session(),
-          self._cintf.get_dev_tgt(), 1,# 1 is flag to read from hardware
+          self._cintf.get_dev_tgt(), read_flags(from_hw),
           key_hdl, data_hdl) 
 
+    def size(self):
+      """ number of entries the table can hold (the length, for an array) """
+      return self._cintf.table_size_get(
+        self._handle,
+        self._cintf.get_session(),
+        self._cintf.get_dev_tgt(), 0).value
+
+    @profiled_table_op("sync")
+    def sync_registers(self, timeout=10.0):
+      """ copy the register from hardware into the driver's software 
+          shadow with a single sync operation. Reads with from_hw=False 
+          return the synced values. """
+      done = threading.Event()
+      sync_cb = RegisterSyncCb(lambda dev_tgt, cookie: done.set())
+      ops_hdl = self._cintf.table_operations_allocate(self._handle, c_int(BFRT_REGISTER_SYNC))
+      try:
+        self._cintf.operations_register_sync_set(ops_hdl, 
+          self._cintf.get_session(), self._cintf.get_dev_tgt(), 
+          sync_cb, None)
+        self._cintf.table_operations_execute(self._handle, ops_hdl)
+        if (not done.wait(timeout)):
+          # the driver may still call the callback, so it must stay alive
+          late_sync_cbs.append(sync_cb)
+          raise ValueError("register sync of %s timed out"%(self.name))
+      finally:
+        self._cintf.table_operations_deallocate(ops_hdl)
+
+    def register_fields(self):
+      """ the data fields of a register table that hold register values """
+      return [info for info in self.data_fields.values() 
+        if ('$bfrt_field_class', 'register_data') in info["annotations"]]
+
+    def bulk_handles(self, n):
+      """ per-thread arrays of n key and n data handles for get_next_n. 
+          They are kept for the thread's later reads, until 
+          release_bulk_handles. """
+      thread_id = threading.get_ident()
+      bulk = self._bulk.get(thread_id)
+      if (bulk == None or bulk[0] < n):
+        self.release_bulk_handles([thread_id])
+        keys = (self._cintf.handle_type * n)()
+        datas = (self._cintf.handle_type * n)()
+        for i in range(n):
+          keys[i] = self._cintf.table_key_allocate(self._handle)
+          datas[i] = self._cintf.table_data_allocate(self._handle)
+        bulk = (n, keys, datas)
+        with self._bulk_lock:
+          self._bulk[thread_id] = bulk
+      return bulk[1], bulk[2]
+
+    def release_bulk_handles(self, thread_ids):
+      """ free the bulk read handles of threads that won't read again """
+      for thread_id in thread_ids:
+        with self._bulk_lock:
+          bulk = self._bulk.pop(thread_id, None)
+        if (bulk == None):
+          continue
+        n, keys, datas = bulk
+        for i in range(n):
+          self._cintf.table_key_deallocate(keys[i])
+          self._cintf.table_data_deallocate(datas[i])
+
+    @profiled_table_op("get_range")
+    def read_register_range(self, start, end, from_hw=False):
+      """ read cells [start, end) of a register table with 
+          table_entry_get + table_entry_get_next_n. 
+          Returns a list with one numpy array per register field, 
+          indexed as [pipe, idx - start], or without numpy, 
+          one list of per-pipe lists per register field. """
+      fields = self.register_fields()
+      n = end - start
+      if (n <= 0):
+        return [np.zeros((0, 0), dtype=np.uint64) if np is not None else [] for _ in fields]
+      get_u64_array = self._cintf.data_field_get_value_u64_array
+      field_ids = [f["id"] for f in fields]
+      # the raw per-pipe values of each cell, by field. They are 
+      # converted to [pipe, cell] arrays in one step at the end.
+      cells = [[] for _ in fields]
+      key_hdl = self.create_key([start])
+      data_hdl = self.create_empty_data()
+      try:
+        retcode = self.cintf_table_get(key_hdl, data_hdl, from_hw)
+        if (retcode != 0):
+          raise ValueError("table_entry_get failed for %s[%i]: %s"%(self.name, start, self._cintf.err_str(retcode)))
+        for field_cells, field_id in zip(cells, field_ids):
+          field_cells.append(get_u64_array(data_hdl, field_id)[:])
+        pos = 1
+        while (pos < n):
+          chunk = min(BULK_READ_CHUNK, n - pos)
+          keys, datas = self.bulk_handles(chunk)
+          num_returned = c_uint(0)
+          # get_next_n returns the entries after key_hdl, so point it at the last cell read
+          self._cintf.table_key_reset(self._handle, key_hdl)
+          self.fill_key(key_hdl, [start + pos - 1])
+          retcode = self._cintf.table_entry_get_next_n(
+            self._handle, 
+            self._cintf.get_session(), 
+            self._cintf.get_dev_tgt(), read_flags(from_hw),
+            key_hdl, keys, datas, c_uint(chunk), byref(num_returned))
+          if (retcode != 0):
+            raise ValueError("table_entry_get_next_n failed for %s[%i]: %s"%(self.name, start + pos, self._cintf.err_str(retcode)))
+          if (num_returned.value == 0):
+            break
+          for field_cells, field_id in zip(cells, field_ids):
+            field_cells.extend([get_u64_array(datas[i], field_id)[:] for i in range(num_returned.value)])
+          pos += num_returned.value
+      finally:
+        self._cintf.table_key_deallocate(key_hdl)
+        self._cintf.table_data_deallocate(data_hdl)
+      results = []
+      for field_cells in cells:
+        # cells that were not returned read as 0
+        n_pipes = len(field_cells[0])
+        field_cells.extend([[0] * n_pipes] * (n - len(field_cells)))
+        if (np is not None):
+          # one row per pipe, one column per cell
+          results.append(np.array(field_cells, dtype=np.uint64).reshape(n, n_pipes).T.copy())
+        else:
+          results.append([list(pipe_vals) for pipe_vals in zip(*field_cells)])
+      return results
+
     def get_data_fields(self, data_handle, action): 
       """ read the fields of table or action """
-      data_fields = self.data_fields
       # if the entry is an action entry, get that action's data fields
-      if (action != None):
-        data_fields = self.actions[action]["data_fields"]
-      # actually get the data fields.
+      # (action is None for actionless tables)
       results = {}
-      for name, info in data_fields.items():
-        is_active = c_bool(False)
+      is_active = c_bool(False)
+      for name, field_id, getter in self.data_getters[action]:
         # not sure what field_is_active checks
-        self._cintf.data_field_is_active(data_handle, info["id"], byref(is_active))
-        dtype = data_type_map(info["data_type"])     
+        self._cintf.data_field_is_active(data_handle, field_id, byref(is_active))
         if (is_active):
-          if (dtype == "BYTE_STREAM"):
-            # case: register read
-            if (('$bfrt_field_class', 'register_data') in info["annotations"]):
-              raw_field_vals = self._cintf.data_field_get_value_u64_array(data_handle, info["id"])
-              field_vals = [raw_field_vals[i] for i in range(len(raw_field_vals))]
-              results[name] = field_vals
-            # case: action argument
-            else:
-              cval, n_bytes = to_c_byte_arr(0, info["size"])
-              # fill val
-              self._cintf.data_field_get_value_ptr(data_handle, info["id"], n_bytes, cval)
-              results[name] = from_c_byte_arr(cval, info["size"])
-          else:
-            dprint("[get_data_fields] unsupported field type: %s"%(dtype))
+          results[name] = getter(data_handle)
       return (action, results)
 
+    @profiled_table_op("get")
     def get_entry(self, key): 
       """ get an entry from a table or array by key. 
           For an array, the key is just the index and the return is a list of values, 
@@ -560,6 +1359,7 @@ class BfRtTable:
         self._cintf.table_data_deallocate(data_hdl)
         return res
 
+    @profiled_table_op("add")
     def add_entry(self, key, action_name, args, ret_hdl=False):
       """ add or update a table entry by key. 
           Returns the key handle if ret_hdl=True and the install succeeded """
@@ -618,6 +1418,156 @@ class BfRtTable:
 
       raise (ValueError("Internal error: add_entry should not reach this point."))
 
+    @profiled_table_op("add_many")
+    def add_entries(self, entries, batch=True):
+      """ add or update many entries in a single session batch.
+          entries : list of (key, action_name, args), as in add_entry.
+          batch : if False, the caller has already started a batch.
+          One key handle and one data handle per action are allocated 
+          up front and reset between entries. 
+          Returns a list of (position, entry, reason) for failed entries. """
+      return self.write_entries(entries, self.cintf_table_add, "add_entries", batch)
+
+    @profiled_table_op("mod_many")
+    def mod_entries(self, entries, batch=True):
+      """ modify many existing entries in a single session batch. 
+          Arguments and return value are the same as add_entries. """
+      return self.write_entries(entries, self.cintf_table_mod, "mod_entries", batch)
+
+    def write_entries(self, entries, write_fcn, opname, batch):
+      failures = []
+      key_hdl = self._cintf.table_key_allocate(self._handle)
+      data_hdls = {} # action name -> reusable data handle
+      if (batch):
+        self._cintf.begin_batch()
+      try:
+        for pos, entry in enumerate(entries):
+          key, action_name, args = entry
+          try:
+            self._cintf.table_key_reset(self._handle, key_hdl)
+            self.fill_key(key_hdl, key)
+            if (action_name in data_hdls):
+              data_hdl = data_hdls[action_name]
+              self.reset_data(data_hdl, action_name)
+            else:
+              data_hdl = self.allocate_data(action_name)
+              data_hdls[action_name] = data_hdl
+            succ = self.fill_data(data_hdl, action_name, args)
+          except (KeyError, TypeError, ValueError) as e:
+            failures.append((pos, entry, "could not build entry: %s"%(repr(e))))
+            continue
+          if (not succ):
+            failures.append((pos, entry, "could not build entry data struct"))
+            continue
+          retcode = write_fcn(key_hdl, data_hdl)
+          if (retcode != 0):
+            failures.append((pos, entry, self._cintf.err_str(retcode)))
+      finally:
+        if (batch):
+          self._cintf.end_batch()
+        self._cintf.table_key_deallocate(key_hdl)
+        for data_hdl in data_hdls.values():
+          self._cintf.table_data_deallocate(data_hdl)
+      for (pos, _, reason) in failures:
+        print ("WARNING: %s failed for entry %i in %s: %s"%(opname, pos, self.name, reason))
+      return failures
+
+    @profiled_table_op("del_many")
+    def del_entries(self, keys):
+      """ delete many entries, given their keys, in a single session batch. 
+          Returns a list of (position, key, reason) for failed deletes. """
+      failures = []
+      if (len(keys) == 0):
+        return failures
+      key_hdl = self._cintf.table_key_allocate(self._handle)
+      self._cintf.begin_batch()
+      try:
+        for pos, key in enumerate(keys):
+          try:
+            self._cintf.table_key_reset(self._handle, key_hdl)
+            self.fill_key(key_hdl, key)
+          except (KeyError, TypeError, ValueError) as e:
+            failures.append((pos, key, "could not build key: %s"%(repr(e))))
+            continue
+          retcode = self.cintf_table_del(key_hdl)
+          if (retcode != 0):
+            failures.append((pos, key, self._cintf.err_str(retcode)))
+      finally:
+        self._cintf.end_batch()
+        self._cintf.table_key_deallocate(key_hdl)
+      for (pos, _, reason) in failures:
+        print ("WARNING: del_entries failed for entry %i in %s: %s"%(pos, self.name, reason))
+      return failures
+
+    def clear(self):
+      """ delete every entry in the table """
+      sts = self._cintf.table_clear(
+        self._handle, 
+        self._cintf.get_session(),
+        self._cintf.get_dev_tgt(), 0)
+      if (sts != 0):
+        raise ValueError("table_clear failed for %s: %s"%(self.name, self._cintf.err_str(sts)))
+
+    def usage(self, from_hw=False):
+      """ number of entries installed in the table """
+      return self._cintf.table_usage_get(
+        self._handle,
+        self._cintf.get_session(),
+        self._cintf.get_dev_tgt(), read_flags(from_hw)).value
+
+    def decode_entry(self, key_hdl, data_hdl):
+      """ (key, action_name, args) of an entry read into key_hdl and data_hdl """
+      key = {name:getter(key_hdl) for name, getter in self.key_getters.items()}
+      action_name = None
+      if (len(self.actions) > 0):
+        action_name = self.action_id_name_map[self._cintf.data_action_id_get(data_hdl).value]
+      _, args = self.get_data_fields(data_hdl, action_name)
+      return (key, action_name, args)
+
+    @profiled_table_op("get_all")
+    def read_entries(self, from_hw=False):
+      """ read every entry in the table with table_entry_get_first and 
+          table_entry_get_next_n. Returns a list of (key, action_name, args), 
+          with keys as dicts that can be passed to add_entry. """
+      n = self.usage(from_hw)
+      entries = []
+      if (n == 0):
+        return entries
+      key_hdl = self._cintf.table_key_allocate(self._handle)
+      data_hdl = self.create_empty_data()
+      try:
+        retcode = self._cintf.table_entry_get_first(
+          self._handle, 
+          self._cintf.get_session(), 
+          self._cintf.get_dev_tgt(), read_flags(from_hw),
+          key_hdl, data_hdl)
+        if (retcode != 0):
+          raise ValueError("table_entry_get_first failed for %s: %s"%(self.name, self._cintf.err_str(retcode)))
+        entries.append(self.decode_entry(key_hdl, data_hdl))
+        while (len(entries) < n):
+          chunk = min(BULK_READ_CHUNK, n - len(entries))
+          keys, datas = self.bulk_handles(chunk)
+          num_returned = c_uint(0)
+          retcode = self._cintf.table_entry_get_next_n(
+            self._handle, 
+            self._cintf.get_session(), 
+            self._cintf.get_dev_tgt(), read_flags(from_hw),
+            key_hdl, keys, datas, c_uint(chunk), byref(num_returned))
+          if (retcode != 0):
+            raise ValueError("table_entry_get_next_n failed for %s: %s"%(self.name, self._cintf.err_str(retcode)))
+          if (num_returned.value == 0):
+            break
+          for i in range(num_returned.value):
+            entries.append(self.decode_entry(keys[i], datas[i]))
+          # continue after the last entry read, which the next call overwrites
+          self._cintf.table_key_reset(self._handle, key_hdl)
+          self.fill_key(key_hdl, entries[-1][0])
+      finally:
+        self._cintf.table_key_deallocate(key_hdl)
+        self._cintf.table_data_deallocate(data_hdl)
+      return entries
+
+    @profiled_table_op("del")
     def del_entry(self, key_handle):
       """delete an entry, given an already existing key handle """
       sts = self._cintf.table_entry_del(
@@ -632,6 +1582,47 @@ class BfRtTable:
       # deallocate key
       self._cintf.table_key_deallocate(key_handle)
 
+# read flags for table_entry_get and friends
+def read_flags(from_hw):
+  return 1 if from_hw else 0
+
+def same_field_value(new_val, cur_val):
+  """ compare a data field value to one read from the device, 
+      where arrays may be lists, bytearrays or numpy arrays """
+  if (isinstance(cur_val, (list, tuple, bytearray)) or (np is not None and isinstance(cur_val, np.ndarray))):
+    try:
+      return [int(v) for v in new_val] == [int(v) for v in cur_val]
+    except (TypeError, ValueError):
+      return False
+  return new_val == cur_val
+
+def compile_key_encoder(field_info):
+  """ build a function value -> bytes that encodes a key field value 
+      canonically, matching how the key setter interprets the value. 
+      Raises ValueError for values that don't fit in the field. """
+  n_bytes = (field_info["size"] + 7) // 8
+  key_type = key_type_map(field_info["type"])
+  field_max = (1<<field_info["size"]) - 1
+  def to_bytes(val):
+    val = val.__index__() if hasattr(val, "__index__") else val
+    if (type(val) != int or val < 0 or val > field_max):
+      raise ValueError("key field %s: %r is not a %i-bit unsigned value"%(field_info["name"], val, field_info["size"]))
+    return val.to_bytes(n_bytes, 'big')
+  if (key_type == "EXACT"):
+    def encode(field_val):
+      return to_bytes(field_val)
+  elif (key_type == "TERNARY"):
+    # non-tuple values are installed as value 0 with the default mask
+    default_mask = field_max
+    def encode(field_val):
+      value, mask = field_val if (type(field_val) == tuple) else (0, default_mask)
+      to_bytes(value)
+      return to_bytes(value & mask) + to_bytes(mask)
+  else:
+    def encode(field_val):
+      return repr(field_val).encode('ascii')
+  return encode
+
 # type maps
 def key_type_map(key_type):
     if key_type == 0:
@@ -672,18 +1663,92 @@ def data_type_map(data_type):
         return "BFRT_CLI_DATA_TYPE_NOT_IMPLEMENTED"
 
 
+class TableDirectory(Mapping):
+  """ The tables of a program, by name. A BfRtTable is only 
+      built when it is first accessed, from the metadata cache if possible. """
+  def __init__(self, cintf, table_hdls, metadata_cache=None):
+    self._cintf = cintf
+    self._hdls = table_hdls
+    self._cache = metadata_cache
+    self._tables = {}
+    self._lock = threading.Lock()
+
+  def __getitem__(self, name):
+    tbl = self._tables.get(name)
+    if (tbl != None):
+      return tbl
+    with self._lock:
+      if (name not in self._tables):
+        metadata = None
+        if (self._cache != None):
+          metadata = self._cache.get(name)
+        tbl = BfRtTable(self._cintf, self._hdls[name], metadata)
+        if (self._cache != None and metadata == None):
+          self._cache.put(name, tbl.to_metadata())
+        self._tables[name] = tbl
+      return self._tables[name]
+
+  def __iter__(self):
+    return iter(self._hdls)
+
+  def __len__(self):
+    return len(self._hdls)
+
+class TableMetadataCache(object):
+  """ Table definitions of a program, saved as a json file named 
+      by a hash of the program (see program_fingerprint) """
+  def __init__(self, cache_dir, progname, fingerprint):
+    self.fn = Path(cache_dir) / ("%s-%s.json"%(progname, fingerprint))
+    self.tables = {}
+    self.dirty = False
+    if (self.fn.exists()):
+      try:
+        self.tables = json.load(open(self.fn, "r"))
+      except json.JSONDecodeError:
+        print ("WARNING: ignoring corrupt table metadata cache %s"%(self.fn))
+    dprint ("metadata cache %s: %i tables"%(self.fn, len(self.tables)))
+
+  def get(self, name):
+    return self.tables.get(name, None)
+
+  def put(self, name, metadata):
+    self.tables[name] = metadata
+    self.dirty = True
+
+  def save(self):
+    if (not self.dirty):
+      return
+    self.fn.parent.mkdir(parents=True, exist_ok=True)
+    # write then rename, so that a crash never leaves a partial cache
+    tmp_fn = self.fn.with_suffix(".tmp")
+    with open(tmp_fn, "w") as f:
+      json.dump(self.tables, f)
+    os.replace(tmp_fn, self.fn)
+    self.dirty = False
+
+def program_fingerprint(bfrt_json_fn):
+  """ hash of a program's bfrt.json. (Table names alone are not enough: a 
+      recompile can keep them and change the key, action and data field ids.) """
+  h = hashlib.sha256()
+  h.update(open(bfrt_json_fn, "rb").read())
+  return h.hexdigest()[:16]
+
 class LibcInterface(object):
   """ Low level interface to the C driver library. """
-  def __init__(self, libdriver_fn):
+  def __init__(self, libdriver_fn, metadata_cache_dir=None, bfrt_json_fn=None, profile=False):
     # open dll
     self._driver = CDLL(libdriver_fn)
     self._dev_id = 0
+    # latency profile of driver calls, if enabled
+    self.profile = DriverProfile() if profile else None
+    # per-thread session and target overrides, see bind_thread
+    self._thread = threading.local()
     # init types
     self.init_tys()
     # add wrapped functions
     self.wrap_clib_fcns()
     # load program info
-    self.load_progs()
+    self.load_progs(metadata_cache_dir, bfrt_json_fn)
     # start session
     if (not self.start_session()):
       raise(ValueError("Critical error: could not start session."))
@@ -700,7 +1765,7 @@ class LibcInterface(object):
       _fields_ = [("name", c_char_p), ("value", c_char_p)]
 
 
-  def load_progs(self):
+  def load_progs(self, metadata_cache_dir=None, bfrt_json_fn=None):
     """ get names of p4 programs loaded into switch, 
         then load their names and other info """
     # get names of p4 programs loaded onto switchd
@@ -711,13 +1776,29 @@ class LibcInterface(object):
     self._driver.bf_rt_p4_names_get(self._dev_id, p4_names)
     # load programs. each progam is just a dictionary of tables.
     self.progs = {}
+    self.metadata_caches = []
+    if (metadata_cache_dir != None and bfrt_json_fn == None):
+      print ("WARNING: table metadata cache disabled, because it needs the program's bfrt.json")
+      metadata_cache_dir = None
     for name in p4_names:
       prog_handle = self.info_get(self._dev_id, name)
-      tables = {}
+      table_hdls = {}
       for table_hdl in self.tables_get_array(prog_handle):
-        tbl_obj = BfRtTable(self, table_hdl)      
-        tables[tbl_obj.name] = tbl_obj
-      self.progs[name] = tables
+        table_hdls[self.table_name_get(table_hdl).value.decode('ascii')] = table_hdl
+      cache = None
+      if (metadata_cache_dir != None):
+        fingerprint = program_fingerprint(bfrt_json_fn)
+        cache = TableMetadataCache(metadata_cache_dir, name.decode('ascii'), fingerprint)
+        self.metadata_caches.append(cache)
+      self.progs[name] = TableDirectory(self, table_hdls, cache)
+    if (self.metadata_caches):
+      # also save at exit, for scripts that never call Controller.close 
+      # or that stop with an exception (saving twice is a no-op)
+      atexit.register(self.save_metadata_caches)
+
+  def save_metadata_caches(self):
+    for cache in self.metadata_caches:
+      cache.save()
 
   def start_session(self):
     self._session = self.sess_type()
@@ -726,22 +1807,57 @@ class LibcInterface(object):
       return False    
     return True
 
+  def create_session(self):
+    """ create an additional session, e.g., for a worker thread """
+    session = self.sess_type()
+    self.try_cmd_with_err("error creating session", 
+      self._driver.bf_rt_session_create, byref(session))
+    return session
+
+  def destroy_session(self, session):
+    self._driver.bf_rt_session_destroy(session)
+
+  def bind_thread(self, session, pipe_id=0xFFFF):
+    """ make operations from the calling thread use session, 
+        and target pipe_id (0xFFFF is all pipes) """
+    self._thread.session = session
+    self._thread.dev_tgt = BfDevTgt(self._dev_id, pipe_id, 0xff, 0xff)
+
+  def begin_batch(self):
+    """ start batching operations on the session. Table operations 
+        are queued until end_batch pushes them to the device. """
+    self.try_cmd_with_err("error beginning batch", 
+      self.profiled("begin_batch", self._driver.bf_rt_begin_batch), self.get_session())
+
+  def end_batch(self, hw_synchronous=True):
+    """ push the current batch, optionally waiting for the 
+        hardware to complete it """
+    self.try_cmd_with_err("error ending batch", 
+      self.profiled("end_batch", self._driver.bf_rt_end_batch), self.get_session(), c_bool(hw_synchronous))
+
   def close_session(self):
     # close the session
     print ("closing session")
     self._driver.bf_rt_session_destroy(self._session)
 
   # public helpers 
+  # (threads that called bind_thread get their own session and target)
   def get_session(self):
-      return self._session
+      return getattr(self._thread, "session", self._session)
   def get_dev_tgt(self):
-      return byref(self._dev_tgt)
+      return byref(getattr(self._thread, "dev_tgt", self._dev_tgt))
   def err_str(self, sts):
       estr = c_char_p()
       self._driver.bf_rt_err_str(c_int(sts), byref(estr))
       return estr.value.decode('ascii')
 
   # command wrapping
+  def profiled(self, fname, fcn):
+    """ fcn, timed under fname if profiling is enabled """
+    if (self.profile == None):
+      return fcn
+    return self.profile.timed(fname, fcn)
+
   def run_cmd(self, fcn, *args):
     return fcn(*args)
 
@@ -751,6 +1867,7 @@ class LibcInterface(object):
 
   def wrap_clib_fcn(self, fname, ret_obj_constr, ret_obj_constr_args, fcn):
     """ Wrap a clib function that fills the object referenced by the last argument """
+    fcn = self.profiled(fname, fcn)
     def fcn_wrapper(*args):
       ret_obj = ret_obj_constr(*ret_obj_constr_args)
       args = args + (byref(ret_obj),)
@@ -761,6 +1878,7 @@ class LibcInterface(object):
 
   def wrap_clib_method(self, fname, fcn):
     """ Wrap a clib function, throw error if retcode is wrong """
+    fcn = self.profiled(fname, fcn)
     def method_wrapper(*args):
       # print ("calling try_cmd with args: %s"%(str(args)))
       self.try_cmd_with_err("error calling clib method %s"%(fname), fcn, *args)
@@ -768,12 +1886,15 @@ class LibcInterface(object):
 
   def wrap_clib_method_get_returncode(self, fname, fcn):
     """ Wrap a clib function and get its return code """
+    fcn = self.profiled(fname, fcn)
     def method_wrapper(*args):
       return self.run_cmd(fcn, *args)
     setattr(self, fname, method_wrapper)
 
   def wrap_clib_array_fcn(self, fname, ret_obj_constr, ret_obj_constr_args, size_fcn, fcn):
     """ Wrap a clib function that fills the _array of objects_ referenced by the last argument """
+    size_fcn = self.profiled(fname + "_size", size_fcn)
+    fcn = self.profiled(fname, fcn)
     def array_fcn_wrapper(*args):
       # get size
       size_obj = c_uint(0)
@@ -812,17 +1933,29 @@ class LibcInterface(object):
       ("table_key_allocate", self.handle_type, (), self._driver.bf_rt_table_key_allocate),
       ("table_action_data_allocate", self.handle_type, (), self._driver.bf_rt_table_action_data_allocate),
       ("table_data_allocate", self.handle_type, (), self._driver.bf_rt_table_data_allocate),
-      ("data_action_id_get", c_uint, (-1,), self._driver.bf_rt_data_action_id_get)
+      ("data_action_id_get", c_uint, (-1,), self._driver.bf_rt_data_action_id_get),
+      ("table_size_get", c_size_t, (0,), self._driver.bf_rt_table_size_get),
+      ("table_usage_get", c_uint, (0,), self._driver.bf_rt_table_usage_get),
+      ("table_operations_allocate", self.handle_type, (), self._driver.bf_rt_table_operations_allocate)
 
     ]
     method_sigs = [
       ("key_field_set_value", self._driver.bf_rt_key_field_set_value),
       ("key_field_set_value_and_mask", self._driver.bf_rt_key_field_set_value_and_mask),
+      ("key_field_get_value", self._driver.bf_rt_key_field_get_value),
+      ("key_field_get_value_and_mask", self._driver.bf_rt_key_field_get_value_and_mask),
       ("bf_rt_container_data_field_list_get", self._driver.bf_rt_container_data_field_list_get),
       ("data_field_set_value_ptr", self._driver.bf_rt_data_field_set_value_ptr),
       ("data_field_get_value_ptr", self._driver.bf_rt_data_field_get_value_ptr),
       ("data_field_set_value", self._driver.bf_rt_data_field_set_value),
+      ("data_field_get_value", self._driver.bf_rt_data_field_get_value),
+      ("data_field_get_bool", self._driver.bf_rt_data_field_get_bool),
+      ("data_field_get_string_size", self._driver.bf_rt_data_field_get_string_size),
+      ("data_field_get_string", self._driver.bf_rt_data_field_get_string),
       ("table_key_deallocate", self._driver.bf_rt_table_key_deallocate),
+      ("table_key_reset", self._driver.bf_rt_table_key_reset),
+      ("table_data_reset", self._driver.bf_rt_table_data_reset),
+      ("table_action_data_reset", self._driver.bf_rt_table_action_data_reset),
       ("table_data_deallocate", self._driver.bf_rt_table_data_deallocate),
       ("data_field_set_value_array", self._driver.bf_rt_data_field_set_value_array),
       ("data_field_set_value_bool_array", self._driver.bf_rt_data_field_set_value_bool_array),
@@ -830,12 +1963,18 @@ class LibcInterface(object):
       ("data_field_set_string", self._driver.bf_rt_data_field_set_string),
       ("table_entry_key_get", self._driver.bf_rt_table_entry_key_get),
       ("data_field_is_active", self._driver.bf_rt_data_field_is_active),
+      ("operations_register_sync_set", self._driver.bf_rt_operations_register_sync_set),
+      ("table_operations_execute", self._driver.bf_rt_table_operations_execute),
+      ("table_operations_deallocate", self._driver.bf_rt_table_operations_deallocate),
     ]
     method_with_retcode = [
       ("table_entry_add", self._driver.bf_rt_table_entry_add),
       ("table_entry_del", self._driver.bf_rt_table_entry_del),
       ("table_entry_mod", self._driver.bf_rt_table_entry_mod),
       ("table_entry_get", self._driver.bf_rt_table_entry_get),
+      ("table_entry_get_first", self._driver.bf_rt_table_entry_get_first),
+      ("table_entry_get_next_n", self._driver.bf_rt_table_entry_get_next_n),
+      ("table_clear", self._driver.bf_rt_table_clear),
     ]
     array_fcn_sigs = [
       # wrapped function name, array element type, array type args, length getter, element getter
@@ -862,7 +2001,13 @@ class LibcInterface(object):
         self._driver.bf_rt_data_field_annotations_with_action_get),
       ("data_field_get_value_u64_array", c_ulonglong, (), # args: (data_handle, field_id)
         self._driver.bf_rt_data_field_get_value_u64_array_size,
-        self._driver.bf_rt_data_field_get_value_u64_array)
+        self._driver.bf_rt_data_field_get_value_u64_array),
+      ("data_field_get_value_array", c_uint, (), # args: (data_handle, field_id)
+        self._driver.bf_rt_data_field_get_value_array_size,
+        self._driver.bf_rt_data_field_get_value_array),
+      ("data_field_get_value_bool_array", c_bool, (), # args: (data_handle, field_id)
+        self._driver.bf_rt_data_field_get_value_bool_array_size,
+        self._driver.bf_rt_data_field_get_value_bool_array)
 
     ]
 
@@ -892,22 +2037,60 @@ class BfDevTgt(Structure):
 class BfRtHandle(Structure):
     _fields_ = [("unused", c_int)]
 
-
-def to_c_byte_arr(py_value, size):
-    """Converts an array of python ints into a c byte array of the given size in bits"""
+# bf_rt_register_sync_cb: void (*)(bf_rt_target_t *dev_tgt, void *cookie)
+RegisterSyncCb = CFUNCTYPE(None, POINTER(BfDevTgt), c_void_p)
+# bf_rt_table_operations_mode_t
+BFRT_REGISTER_SYNC = 0
+# number of entries requested per table_entry_get_next_n call
+BULK_READ_CHUNK = 1024
+# callbacks of register syncs that timed out
+late_sync_cbs = []
+
+
+# per-thread cache of c byte buffers, keyed by size in bytes
+_c_byte_bufs = threading.local()
+
+def c_byte_buf(n_bytes):
+    """Get a c byte array of n_bytes that is reused by the calling thread. 
+       Its contents are only valid until the next call for the same size."""
+    bufs = _c_byte_bufs.__dict__
+    buf = bufs.get(n_bytes)
+    if buf is None:
+        buf = (c_ubyte * n_bytes)()
+        bufs[n_bytes] = buf
+    return buf
+
+def to_c_byte_arr(py_value, size, reuse=False):
+    """Converts a python int into a big-endian c byte array of the given size in bits. 
+       If reuse is true, the array is a per-thread buffer from c_byte_buf."""
     n_bytes = (size + 7) // 8
-    value_type = c_ubyte * n_bytes
-    value = value_type()
-    for i in range(0, n_bytes):
-        value[i] = (py_value >> 8 * (n_bytes - (i + 1))) & 0xFF
+    # mask to n_bytes, so that wide or negative values truncate like before
+    raw = (py_value & ((1 << (8 * n_bytes)) - 1)).to_bytes(n_bytes, 'big')
+    if (reuse):
+        value = c_byte_buf(n_bytes)
+        memmove(value, raw, n_bytes)
+    else:
+        value = (c_ubyte * n_bytes).from_buffer_copy(raw)
     return value, n_bytes
 
 def from_c_byte_arr(value, size):
     n_bytes = (size + 7) // 8
-    py_value = 0
-    for i in range(0, n_bytes):
-        py_value += value[i] << (n_bytes - (i + 1)) * 8
-    return py_value
+    return int.from_bytes(memoryview(value)[:n_bytes], 'big')
+
+def to_c_uint_arr(py_values):
+    """Converts a sequence of ints into a c uint array, without a per-element python loop. 
+       Returns the array (or a pointer to numpy-owned memory) and its length."""
+    arrlen = len(py_values)
+    if (np is not None):
+        try:
+            # wrap values to 32 bits, like c_uint does (e.g., -1 -> 0xffffffff)
+            arr = np.ascontiguousarray(np.asarray(py_values, dtype=np.int64).astype(np.uint32))
+        except OverflowError:
+            # values beyond 64 bits: let c_uint wrap them
+            return (c_uint * arrlen)(*py_values), arrlen
+        # the returned pointer keeps a reference to arr through _arr
+        return arr.ctypes.data_as(POINTER(c_uint)), arrlen
+    return (c_uint * arrlen)(*py_values), arrlen
 
 
 def check_sde_version(sde):
@@ -16,9 +16,8 @@ let find_spec_file dpt_file =
     else None)
 ;;
 
-let main () = 
-  let target_filename = Cmdline.parse () in
-  Cmdline.set_dpt_file target_filename; 
+let run target_filename =
+  Cmdline.set_dpt_file target_filename;
   let ds = Input.parse target_filename in
   let renaming, ds = 
     (* Profile.time_profile "frontend" @@ fun () -> *)
@@ -52,4 +51,114 @@ let main () =
       print_endline @@ InterpState.State.nst_to_string nst))
 ;;
 
+(* Server mode: each request runs in a forked copy of the server, so it
+   starts from the same fresh global state as a new dpt process, and its
+   exit status (or uncaught exception) is reported just like one. The
+   server loads the binary and its libraries once, and initializes the
+   runtimes that every run needs (see initialize_server) before forking,
+   so the runs inherit them instead of starting them again. *)
+let redirect fd path flags =
+  let path = Option.default "/dev/null" path in
+  let new_fd = Unix.openfile path flags 0o644 in
+  Unix.dup2 new_fd fd;
+  Unix.close new_fd
+;;
+
+(* OCaml uses its own negative numbers for the signals it knows. Map them
+   back to the (Linux) POSIX numbers, so that a run killed by a signal
+   reports 128 + its number, as a shell does for a directly spawned dpt. *)
+let posix_signal signal =
+  let known =
+    [ Sys.sighup, 1
+    ; Sys.sigint, 2
+    ; Sys.sigquit, 3
+    ; Sys.sigill, 4
+    ; Sys.sigtrap, 5
+    ; Sys.sigabrt, 6
+    ; Sys.sigbus, 7
+    ; Sys.sigfpe, 8
+    ; Sys.sigkill, 9
+    ; Sys.sigusr1, 10
+    ; Sys.sigsegv, 11
+    ; Sys.sigusr2, 12
+    ; Sys.sigpipe, 13
+    ; Sys.sigalrm, 14
+    ; Sys.sigterm, 15
+    ; Sys.sigxcpu, 24
+    ; Sys.sigxfsz, 25 ]
+  in
+  (* signals OCaml doesn't know are already positive POSIX numbers *)
+  try List.assoc signal known with
+  | Not_found -> signal
+;;
+
+let serve_request request =
+  let open Yojson.Basic.Util in
+  let args = request |> member "args" |> to_list |> List.map to_string in
+  let path field = request |> member field |> to_string_option in
+  let out_flags = [Unix.O_WRONLY; Unix.O_CREAT; Unix.O_TRUNC] in
+  flush_all ();
+  match Unix.fork () with
+  | 0 ->
+    redirect Unix.stdin (path "stdin") [Unix.O_RDONLY];
+    redirect Unix.stdout (path "stdout") out_flags;
+    redirect Unix.stderr (path "stderr") out_flags;
+    let status =
+      try
+        let argv = Array.of_list (Sys.executable_name :: args) in
+        run (Cmdline.parse_interp ~argv ());
+        0
+      with
+      | Arg.Help msg ->
+        print_string msg;
+        0
+      | Arg.Bad msg ->
+        prerr_string msg;
+        2
+      | e ->
+        prerr_endline ("Fatal error: exception " ^ Printexc.to_string e);
+        2
+    in
+    exit status
+  | pid ->
+    (match snd (Unix.waitpid [] pid) with
+     | Unix.WEXITED code -> code
+     | Unix.WSIGNALED signal | Unix.WSTOPPED signal -> 128 + posix_signal signal)
+;;
+
+(* start the Python runtime that interpreter specs use for externs, and
+   warm up Z3 (context creation and the first solver check load most of
+   its state), so that forked runs start with both ready *)
+let initialize_server () =
+  if not (Py.is_initialized ()) then Py.initialize ();
+  let ctx = Z3.mk_context [] in
+  let solver = Z3.Solver.mk_simple_solver ctx in
+  ignore (Z3.Solver.check solver [Z3.Boolean.mk_true ctx])
+;;
+
+let serve () =
+  initialize_server ();
+  let rec loop () =
+    match input_line stdin with
+    | exception End_of_file -> ()
+    | "" -> loop ()
+    | line ->
+      let status =
+        try serve_request (Yojson.Basic.from_string line) with
+        | Yojson.Json_error msg | Yojson.Basic.Util.Type_error (msg, _) ->
+          prerr_endline ("Bad server request: " ^ msg);
+          2
+      in
+      print_endline (Yojson.Basic.to_string (`Assoc ["status", `Int status]));
+      flush stdout;
+      loop ()
+  in
+  loop ()
+;;
+
+let main () =
+  let target_filename = Cmdline.parse () in
+  if cfg.server then serve () else run target_filename
+;;
+
 let _ = main ()
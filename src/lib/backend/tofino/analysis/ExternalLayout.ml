@@ -13,9 +13,49 @@ let info str =
 exception Error of string
 let error s = raise (Error s)
 
+(*** structured resources of a vertex ***)
+(* the primitive operations (one per line of the 
+   printed statement) that a vertex's table executes *)
+let rec ops_of_stmt stmt = 
+  match stmt.s with 
+  | SNoop -> []
+  | SSeq(s1, s2) -> (ops_of_stmt s1)@(ops_of_stmt s2)
+  | SMatch(_, bs) -> List.map (fun (_, s) -> ops_of_stmt s) bs |> List.flatten
+  | _ -> [stmt]
+;;
+
+(* format: {"arrays" : [str]; "keys" : [str]; 
+            "array_ops" : [str]; "hash_ops" : [str]; "alu_ops" : [str]} *)
+let json_of_resources stmt = 
+  let json_strings strs = `List (List.map (fun str -> `String str) strs) in
+  let keys = match stmt.s with 
+    | SMatch(es, _) -> List.map CorePrinting.exp_to_string es
+    | _ -> []
+  in
+  let arrays = TofinoResources.arrays_of_stmt stmt |> List.map Cid.to_string in
+  let ops = ops_of_stmt stmt 
+    |> List.map (fun op -> (op, CorePrinting.statement_to_string op)) 
+  in
+  let array_ops, other_ops = List.partition 
+    (fun (op, _) -> TofinoResources.arrays_of_stmt op <> []) 
+    ops 
+  in
+  let hash_ops, alu_ops = List.partition 
+    (fun (op, _) -> TofinoResources.hashers_of_stmt op <> []) 
+    other_ops
+  in
+  `Assoc [
+    "arrays", json_strings arrays;
+    "keys", json_strings keys;
+    "array_ops", json_strings (List.map snd array_ops);
+    "hash_ops", json_strings (List.map snd hash_ops);
+    "alu_ops", json_strings (List.map snd alu_ops)
+  ]
+;;
+
 (*** json printers ***)
 let json_of_vertices g = 
-  (* format: {"iid": int; "code" : str} *)
+  (* format: {"iid": int; "code" : str; "user_table" : str; "resources" : {...}} *)
   let json_of_vertex v = 
     let viid = vertex_num v in
     let vcodestr = CorePrinting.statement_to_string v.stmt in
@@ -23,7 +63,8 @@ let json_of_vertices g =
     `Assoc [
       ("id", `Int viid); 
       ("statement",`String vcodestr);
-      ("user_table", `String is_user_tbl)
+      ("user_table", `String is_user_tbl);
+      ("resources", json_of_resources v.stmt)
     ]
   in
   let vertex_jsons = (Dfg.fold_vertex 
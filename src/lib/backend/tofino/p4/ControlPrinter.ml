@@ -60,8 +60,7 @@ def init(c, ports_up):
   if ports_up: 
     for port in ports:    
       c.port_up(*port)
-  for mc_group in mc_groups:
-    c.add_multicast_group(*mc_group)
+  c.add_multicast_groups(mc_groups)
 # *)*)
 # some helpers
 def find_file(filename, directory):
@@ -24,6 +24,8 @@ type config =
   ; mutable show_printf        : bool (* report printf statements *)
   ; mutable interactive : bool
       (** Run interpreter interactively (stdin / stdout) **)
+  ; mutable server : bool
+      (** Serve interpreter runs requested on stdin, one per line **)
   ; mutable output : string
   ; mutable json : bool (* tofino backend *) (** Print json outputs **)
   ; mutable builddir : string (* build directory where p4 + other code goes *)
@@ -61,6 +63,7 @@ let default () =
   ; show_interp_events = true
   ; show_printf = true
   ; interactive = false
+  ; server = false
   ; output = "lucid.output"
   ; json = false
   ; builddir = "lucid_tofino_build"
@@ -156,7 +159,9 @@ let parse_common () =
   speclist
 ;;
 
-let parse_interp () =
+(* argv is parsed instead of Sys.argv when given (i.e., by server mode);
+   bad arguments then raise Arg.Bad / Arg.Help rather than exiting *)
+let parse_interp ?argv () =
   (* common options *)
   let speclist = parse_common () in
   (* added options for interp *)
@@ -195,11 +200,20 @@ let parse_interp () =
         , Arg.Unit set_interactive
         , "Run interpreter interactively, piping events to/from stdin/stdout \
             disables verbose and suppresses final state and event reports" )
+      ; ( "--server"
+        , Arg.Unit (fun () -> cfg.server <- true)
+        , "Run as a persistent interpreter server. Reads one json request \
+            {\"args\": [...], \"stdin\": path, \"stdout\": path, \"stderr\": path} \
+            per line of stdin, runs it in a forked copy of the interpreter, and \
+            replies with a line {\"status\": exit code}." )
       ]
   in
   let target_filename = ref "" in
   let usage_msg = "Lucid command line. Options available:" in
-  Arg.parse speclist (fun s -> target_filename := s) usage_msg;
+  let anon_fun s = target_filename := s in
+  (match argv with
+   | None -> Arg.parse speclist anon_fun usage_msg
+   | Some argv -> Arg.parse_argv ~current:(ref 0) argv speclist anon_fun usage_msg);
   !target_filename
 ;;
 
@@ -305,6 +305,12 @@ let simulate (nst : State.network_state) =
     - Output:
       - prints each exit event to stdout as a json, one event per line
       - all printfs in the program print to stderr
+    - Flushing:
+      - a {"flush": id} line on stdin is a request, not an event
+      - once every event before it has been interpreted and there is nothing
+        left to do, the interpreter prints {"flushed": id} to stdout. Test
+        harnesses wait for it to know that the output for their events is
+        complete, and then close stdin.
 **)
 
 type event_getter = int -> InterpJson.interp_input list
@@ -412,18 +418,38 @@ let non_blocking_read_lines fd =
     else []
 ;;
 
+(* ids of flush requests read from stdin, most recent first *)
+let pending_flushes = ref []
+
+(* acknowledge the pending flush requests, once the interpreter is idle *)
+let acknowledge_flushes (nst : State.network_state) =
+  if not (List.is_empty !pending_flushes)
+  then (
+    run_egress_events Cmdline.cfg.show_interp_events nst;
+    List.iter
+      (fun id -> print_endline (Yojson.Basic.to_string (`Assoc ["flushed", id])))
+      (List.rev !pending_flushes);
+    pending_flushes := [])
+;;
+
 type interactive_mode_input =
   | Events of interp_input list
   | NoEvents (* no new events, but the file is not closed *)
   | End (* the file is closed *)
 ;;
 let get_input block pp renaming num_switches current_time =
-  let parse_input_str ev_str = InterpSpec.parse_interp_event_list
-    pp
-    renaming
-    num_switches
-    current_time
-    (Yojson.Basic.from_string ev_str)
+  let parse_input_str ev_str =
+    match Yojson.Basic.from_string ev_str with
+    | `Assoc ["flush", id] ->
+      pending_flushes := id :: !pending_flushes;
+      []
+    | input_json ->
+      InterpSpec.parse_interp_event_list
+        pp
+        renaming
+        num_switches
+        current_time
+        input_json
   in
   if (block) then (
     let ev_strs = blocking_read_lines Unix.stdin in
@@ -476,6 +502,7 @@ let run pp renaming (spec : InterpSpec.t) (nst : State.network_state) =
       (* interpret all the queued events, using event_getter to poll for more events
            in between iterations. *)
       let nst = execute_interactive_sim_step (Some get_input_nonblocking) (-1) 0 nst in
+      acknowledge_flushes nst;
       poll_loop nst
   in
   Random.init nst.config.random_seed;
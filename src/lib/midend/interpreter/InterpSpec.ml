@@ -280,11 +280,14 @@ let parse
         (parse_int_entry "seed" (int_of_float @@ Unix.time ()))
     in
     let _ =
-      (* Initialize Python env *)
+      (* Initialize Python env. (dpt --server initializes the default
+         Python once, before forking the runs that get here.) *)
       match List.assoc_opt "python path" lst with
-      | Some (`String library_name) -> Py.initialize ~library_name ()
+      | Some (`String library_name) ->
+        if Py.is_initialized () then Py.finalize ();
+        Py.initialize ~library_name ()
       | Some _ -> error "Python path entry must be a string!"
-      | None -> Py.initialize ()
+      | None -> if not (Py.is_initialized ()) then Py.initialize ()
     in
     let externs, recirc_port_ints =
       let externs =
@@ -1,4 +1,6 @@
-import subprocess, os, filecmp
+import subprocess, os, filecmp, argparse, hashlib, json, re, shutil, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 """
 This script is a simple test harness for the lucid interpreter and lucidcc compiler. 
@@ -14,16 +16,42 @@ If you are adding an application as a test case, you should:
        passes. 
        NOTE: A common failure is non-deterministic output. Make sure to specify the seed in the 
        json test case file to prevent this. 
+
+Tests can run in parallel with "-j N" (e.g., `python3 test/runtests.py -j 8`). 
+Results are always reported in the same order as a serial run.
+
+Passing results are cached in test/.result_cache.json, keyed by a hash of the 
+test's files (the .dpt, files with the same base name like its .json spec, 
+included files, and the expected output) and the dpt / lucidcc binary. Tests 
+whose inputs haven't changed are reported as cached passes without running. 
+Use "--force" to rerun every test.
+
+With "--server", interpreter and typechecking tests are sent to persistent 
+`./dpt --server` processes (one per job) instead of each starting a new dpt. 
+The server runs every test in a fresh fork of itself, so results are the same 
+as with separate processes. If a server can't be started, tests fall back to 
+running ./dpt directly.
+
+Interpreter test output is compared with the expected output line by line as 
+it is produced. The first differing line is reported with the lines before it. 
+With "--fail-fast", a test is stopped at its first differing line and its 
+output is not saved. (With "--server", the output is compared after the test 
+finishes.)
+
+Interactive tests send their input events to `dpt -i` followed by a flush 
+request, and close its input once the interpreter acknowledges that it is idle, 
+so they finish as soon as their output is complete.
 """
 
-# parse a single command line argument: "--lucidcc" to test the c backend, otherwise test interpreter
-test_tgt = "interpreter"
-if len(os.sys.argv) > 1:
-    if os.sys.argv[1] == "--lucidcc":
-        test_tgt = "lucidcc"
-    else:
-        print("Unrecognized argument: "+os.sys.argv[1])
-        os.sys.exit(1)
+# "--lucidcc" to test the c backend, otherwise test interpreter
+parser = argparse.ArgumentParser()
+parser.add_argument("--lucidcc", action="store_true", help="test the c backend instead of the interpreter")
+parser.add_argument("-j", "--jobs", type=int, default=1, help="number of tests to run at once")
+parser.add_argument("--force", action="store_true", help="rerun tests that have cached passing results")
+parser.add_argument("--server", action="store_true", help="run interpreter tests through persistent dpt servers")
+parser.add_argument("--fail-fast", action="store_true", help="stop an interpreter test at its first line of unexpected output")
+cmdline_args = parser.parse_args()
+test_tgt = "lucidcc" if cmdline_args.lucidcc else "interpreter"
 
 
 interpdir = "examples/interp_tests/"
@@ -54,54 +82,263 @@ diffs = []
 if not (os.path.isdir("test/output")):
     os.mkdir("test/output")
 
+class TestLog(object):
+    """ The messages and failures of a single test. Tests return a log instead of 
+        printing and updating the global result lists directly, so that they can 
+        run in parallel and still be reported in order (see run_tests). """
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.lines = []
+        self.errors = []
+        self.bad_successes = []
+        self.diffs = []
+        # (scratch output file, final output file) 
+        self.outputs = []
+        # set by tests that should stop the whole run when they fail
+        self.fatal = False
+        # result cache (see run_test)
+        self.cache_key = None
+        self.cached = False
+        self.cached_outputs = []
+
+    def print(self, *args):
+        self.lines.append(" ".join([str(a) for a in args]))
+
+    def output_path(self, outname):
+        """ a unique scratch path for this test's output, which is 
+            renamed to test/output/outname when the test is reported. """
+        final = "test/output/"+outname
+        scratch = "%s.job%i"%(final, self.job_id)
+        self.outputs.append((scratch, final))
+        return scratch
+
+class InterpServer(object):
+    """ A persistent `./dpt --server` process. It reads one json request per 
+        line and runs it in a fork of itself, replying with the exit status. """
+    def __init__(self, binary="./dpt"):
+        self.binary = binary
+        self.proc = None
+        self.failed = False
+
+    def run(self, args, stdout=None, stderr=None):
+        """ run dpt with args, writing its stdout / stderr to the given paths 
+            (or discarding them), and return its exit code. Returns None if 
+            the server doesn't work, so the caller can run dpt directly. """
+        if self.failed:
+            return None
+        request = {"args" : args, "stdout" : stdout, "stderr" : stderr}
+        try:
+            if self.proc is None:
+                self.proc = subprocess.Popen([self.binary, "--server"], 
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                    stderr=subprocess.DEVNULL, universal_newlines=True)
+            self.proc.stdin.write(json.dumps(request) + "\n")
+            self.proc.stdin.flush()
+            return json.loads(self.proc.stdout.readline())["status"]
+        except (OSError, ValueError, KeyError):
+            # requests run in forks, so the server itself should never die. 
+            self.failed = True
+            self.close()
+            return None
+
+    def close(self):
+        if self.proc is not None:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+            self.proc.wait()
+            self.proc = None
+
+# one server per worker thread, closed at the end of run_tests
+thread_servers = threading.local()
+servers = []
+
+def run_dpt(args, outpath=None):
+    """ run ./dpt with args, writing its output to outpath (or discarding it). 
+        Returns the exit code. """
+    if cmdline_args.server:
+        server = getattr(thread_servers, "server", None)
+        if server is None:
+            server = thread_servers.server = InterpServer()
+            servers.append(server)
+        returncode = server.run(args, stdout=outpath)
+        if returncode is not None:
+            return returncode
+    with open(outpath or os.devnull, "w") as outfile:
+        ret = subprocess.run(["./dpt"] + args, stdout=outfile, stderr=subprocess.DEVNULL)
+    return ret.returncode
+
 # Convention: a test is expected to fail if and only if the test file ends in
 # _wrong.dpt
-def check_return(ret, fullfile):
+def check_return(returncode, fullfile, log):
     expect_error = fullfile.endswith("_wrong.dpt")
-    if ret.returncode != 0 and (not expect_error):
-         print("test returned error: "+"./dpt --silent %s"%fullfile)
-         errors.append(fullfile)
-    if ret.returncode == 0 and expect_error:
-        print("test unexpectedly did NOT return error: "+"./dpt --silent %s"%fullfile)
-        bad_successes.append(fullfile)
-
-def interp_test(fullfile, args):
+    if returncode != 0 and (not expect_error):
+         log.print("test returned error: "+"./dpt --silent %s"%fullfile)
+         log.errors.append(fullfile)
+    if returncode == 0 and expect_error:
+        log.print("test unexpectedly did NOT return error: "+"./dpt --silent %s"%fullfile)
+        log.bad_successes.append(fullfile)
+
+class OutputComparator(object):
+    """ Compares output with an expected output file, one line at a time, 
+        keeping the last few matching lines as context for the first difference. 
+        Lines are bytes, so a full match means the files are identical. """
+    def __init__(self, expected_fn, n_context=3):
+        self.expected_fn = expected_fn
+        self.context = deque(maxlen=n_context)
+        self.lineno = 0
+        # (line number, expected line, output line) of the first difference
+        self.mismatch = None
+        self.missing = False
+        try:
+            self.expected = open(expected_fn, "rb")
+        except OSError:
+            # a missing expected file never matches
+            self.expected = None
+            self.missing = True
+            self.mismatch = (1, b"", b"")
+
+    def feed(self, line):
+        """ compare the next line of output (b"" at the end of output). 
+            Returns False once the output has differed. """
+        if self.mismatch is not None:
+            return False
+        expected = self.expected.readline()
+        self.lineno += 1
+        if line != expected:
+            self.mismatch = (self.lineno, expected, line)
+            self.close()
+            return False
+        self.context.append(line)
+        return True
+
+    def finish(self):
+        """ the output ended. Returns True if it matched the whole expected output. """
+        matched = self.feed(b"")
+        self.close()
+        return matched
+
+    def close(self):
+        if self.expected:
+            self.expected.close()
+            self.expected = None
+
+    def report(self, log):
+        if self.missing:
+            log.print("  expected output file {} is missing".format(self.expected_fn))
+            return
+        lineno, expected, line = self.mismatch
+        show = lambda l: repr(l.decode("utf-8", "replace").rstrip("\n")) if l else "<end of output>"
+        log.print("  first difference at line {} (expected output in {}):".format(lineno, self.expected_fn))
+        for i, ctx in enumerate(self.context):
+            log.print("    {:>6}   {}".format(lineno - len(self.context) + i, show(ctx)))
+        log.print("    {:>6} - {}".format(lineno, show(expected)))
+        log.print("    {:>6} + {}".format(lineno, show(line)))
+
+def stream_dpt(args, outpath, comparator):
+    """ run ./dpt with args, writing its output to outpath and comparing each 
+        line as it arrives. After the first differing line, the rest of the 
+        output is still written, so that outpath is complete (e.g., for 
+        `make promote`), unless --fail-fast is set, in which case dpt is 
+        stopped and outpath is removed. Returns the exit code, or None if 
+        dpt was stopped. """
+    if cmdline_args.server:
+        # the server writes the output itself, so compare it afterwards
+        returncode = run_dpt(args, outpath)
+        with open(outpath, "rb") as outfile:
+            for line in outfile:
+                if not comparator.feed(line):
+                    return returncode
+        comparator.finish()
+        return returncode
+    proc = subprocess.Popen(["./dpt"] + args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    with open(outpath, "wb") as outfile, proc.stdout:
+        for line in proc.stdout:
+            outfile.write(line)
+            if not comparator.feed(line) and cmdline_args.fail_fast:
+                proc.kill()
+                proc.wait()
+                break
+        else:
+            comparator.finish()
+            return proc.wait()
+    # never leave a partial output behind
+    os.remove(outpath)
+    return None
+
+def interp_test(fullfile, args, log):
     shortfile = os.path.splitext(os.path.basename(fullfile))[0]
-    print("Running test on "+shortfile + " ("+fullfile+")")
+    log.print("Running test on "+shortfile + " ("+fullfile+")")
     outname = "{}_output.txt".format(shortfile)
-    with open("test/output/"+outname, "w") as outfile:
-        cmd = ["./dpt", "--silent", fullfile] + args
-        ret = subprocess.run(cmd, stdout=outfile, stderr=subprocess.DEVNULL)
-    check_return(ret, fullfile)
-    if not filecmp.cmp("test/output/"+outname, "test/expected/"+outname):
-        print("test returned different output than expected: "+"./dpt --silent %s"%fullfile)
-        diffs.append(shortfile)
-    outfile.close()
-
-def just_typecheck(path, file, suffix = ""):
-    print("Typechecking "+file)
+    outpath = log.output_path(outname)
+    comparator = OutputComparator("test/expected/"+outname)
+    returncode = stream_dpt(["--silent", fullfile] + args, outpath, comparator)
+    if returncode is not None:
+        check_return(returncode, fullfile, log)
+    if comparator.mismatch is not None:
+        stopped = " (stopped early, output not saved)" if returncode is None else ""
+        log.print("test returned different output than expected"+stopped+": "+"./dpt --silent %s"%fullfile)
+        comparator.report(log)
+        log.diffs.append(shortfile)
+
+def just_typecheck(path, file, log, suffix = ""):
+    log.print("Typechecking "+file)
     fullfile = path+file+suffix
-    cmd = ["./dpt", "--silent",  fullfile]
-    ret = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-    check_return(ret, fullfile)
+    returncode = run_dpt(["--silent",  fullfile])
+    check_return(returncode, fullfile, log)
+
 
+# see "Flushing" in Interp.ml
+flush_request = b'{"flush":1}'
+flush_ack = b'{"flushed":1}'
+interactive_timeout = 30
 
-def interactive_test(fullfile, args):
+def interactive_test(fullfile, args, log):
     shortfile = fullfile[0:-4]
-    print("Running interactive test on "+shortfile)
+    log.print("Running interactive test on "+shortfile)
     outname = "{}_output.txt".format(shortfile)
-    with open("test/output/"+outname, "w") as outfile:
-        fullfile = interpdir+fullfile
-        input_events_fn = "%s.input.txt"%fullfile
-        cmd = ["./dpt", "-i", fullfile] + args
+    outpath = log.output_path(outname)
+    fullfile = interpdir+fullfile
+    input_events_fn = "%s.input.txt"%fullfile
+    cmd = ["./dpt", "-i", fullfile] + args
+    with open(input_events_fn, "rb") as f:
+        events = f.read()
+    if events and not events.endswith(b"\n"):
+        events += b"\n"
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    # a program that never goes idle is stopped, like the old fixed timeout did
+    timer = threading.Timer(interactive_timeout, proc.kill)
+    timer.start()
+    # send the events and a flush request, which the interpreter acknowledges 
+    # once it has handled every event and is idle. Then close stdin, so that 
+    # it finishes up and exits. (Written from a thread, so that a large input 
+    # can't deadlock against the output pipe.)
+    def send_events():
+        try:
+            proc.stdin.write(events + flush_request + b"\n")
+            proc.stdin.flush()
+        except OSError:
+            pass
+    sender = threading.Thread(target=send_events)
+    sender.start()
+    with open(outpath, "wb") as outfile, proc.stdout:
+        for line in proc.stdout:
+            if line.strip() == flush_ack:
+                sender.join()
+                proc.stdin.close()
+            else:
+                outfile.write(line)
+    sender.join()
+    if not proc.stdin.closed:
         try:
-            # interactive mode always waits for more input, so this should timeout
-            ret = subprocess.run(cmd, stdin=open(input_events_fn, "r"),stdout=outfile, stderr=subprocess.DEVNULL, timeout=3)
-        except subprocess.TimeoutExpired:
+            proc.stdin.close()
+        except OSError:
             pass
-        if not filecmp.cmp("test/output/"+outname, "test/expected/"+outname):
-            diffs.append(shortfile)
-        outfile.close()
+    proc.wait()
+    timer.cancel()
+    if not filecmp.cmp(outpath, "test/expected/"+outname):
+        log.diffs.append(shortfile)
 
 def check_lucidcc_compat(incompat_keywords, fullfile):
     fname = fullfile[0:-4]
@@ -115,16 +352,16 @@ def check_lucidcc_compat(incompat_keywords, fullfile):
                     return keyword
     return None
 
-def lucidcc_test(n_tests, i, fullfile, args):
+def lucidcc_test(n_tests, i, fullfile, args, log):
     incompat_keywords = ["Counter.create", "PairArray.create", "Payload.t"]
     incompat = check_lucidcc_compat(incompat_keywords, fullfile)
     if incompat != None:
-        print ("skipping lucidcc test on "+fullfile+" because it contains an incompatible feature: "+str(incompat))
+        log.print ("skipping lucidcc test on "+fullfile+" because it contains an incompatible feature: "+str(incompat))
         return
     if "wrong" in fullfile:
-        print ("skipping lucidcc test on "+fullfile+" because it is expected to fail")
+        log.print ("skipping lucidcc test on "+fullfile+" because it is expected to fail")
         return
-    print ("Running lucid cc test {}/{} on {}".format(str(i), str(n_tests), fullfile))
+    log.print ("Running lucid cc test {}/{} on {}".format(str(i), str(n_tests), fullfile))
     fname = fullfile[0:-4]
     outname = "{}.c".format(fname)
     inname = interpdir+fullfile
@@ -132,14 +369,14 @@ def lucidcc_test(n_tests, i, fullfile, args):
     # print("running command: {}".format(" ".join(cmd)))
     ret = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
     if ret.returncode != 0: 
-        print("----- test failed -----")
-        print("----- stdout -----")
-        print(ret.stdout.decode("utf-8"))
-        print("----- stderr -----")
-        print(ret.stderr.decode("utf-8"))
-        print("failed command: ")
-        print(" ".join(cmd))
-        exit(1)
+        log.print("----- test failed -----")
+        log.print("----- stdout -----")
+        log.print(ret.stdout.decode("utf-8"))
+        log.print("----- stderr -----")
+        log.print(ret.stderr.decode("utf-8"))
+        log.print("failed command: ")
+        log.print(" ".join(cmd))
+        log.fatal = True
     # fulloutfile = 
     # cmd = ["./lucidcc", fullfile, "-o", outname] + args
     # ret = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
@@ -151,26 +388,158 @@ def lucidcc_test(n_tests, i, fullfile, args):
     # outfile.close()
 
 
-if (test_tgt == "interpreter"):
+result_cache_fn = "test/.result_cache.json"
+
+def load_result_cache():
+    try:
+        with open(result_cache_fn, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_result_cache():
+    tmp_fn = result_cache_fn + ".tmp"
+    with open(tmp_fn, "w") as f:
+        json.dump(result_cache, f, indent=1, sort_keys=True)
+    os.replace(tmp_fn, result_cache_fn)
 
-    print("--- interpreter tests ---")
-    for file in interpfiles: interp_test(file, [])
+result_cache = load_result_cache()
 
-    print("--- library tests ---")
-    for file in libraryfiles: just_typecheck(librarydir, file)
+def source_files(srcfile, found=None):
+    """ a test's source file, the files next to it with the same base name 
+        (its json spec, input events, etc.) and everything it includes """
+    found = [] if found is None else found
+    if srcfile in found or not os.path.exists(srcfile):
+        return found
+    found.append(srcfile)
+    srcdir, name = os.path.split(srcfile)
+    base = os.path.splitext(name)[0] + "."
+    found += sorted([os.path.join(srcdir, x) for x in os.listdir(srcdir or ".") 
+        if x.startswith(base) and os.path.join(srcdir, x) not in found])
+    with open(srcfile, "r", errors="replace") as f:
+        for inc in re.findall(r'^\s*include\s+"(.*?)"', f.read(), re.MULTILINE):
+            source_files(os.path.join(srcdir, inc), found)
+    return found
 
-    print("--- interactive interpreter tests ---")
-    for file in interactivefiles: interactive_test(file, [])
+def test_inputs(fcn, args):
+    """ a test's source file and the files that its result depends on """
+    if fcn == interp_test:
+        srcfile = args[0]
+        shortfile = os.path.splitext(os.path.basename(srcfile))[0]
+        expected = ["test/expected/{}_output.txt".format(shortfile)]
+    elif fcn == just_typecheck:
+        srcfile, expected = "".join(args), []
+    elif fcn == interactive_test:
+        srcfile = interpdir+args[0]
+        expected = ["test/expected/{}_output.txt".format(args[0][0:-4])]
+    else: # lucidcc_test
+        srcfile, expected = interpdir+args[2], []
+    binary = "./lucidcc" if fcn == lucidcc_test else "./dpt"
+    return srcfile, [binary] + source_files(srcfile) + expected
 
-    print("--- other tests ---")
-    for file in regressionfiles: just_typecheck(regressiondir, file)
+file_hashes = {}
+
+def hash_file(fn):
+    if fn not in file_hashes:
+        h = hashlib.sha256()
+        try:
+            with open(fn, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    h.update(chunk)
+            file_hashes[fn] = h.hexdigest()
+        except OSError:
+            file_hashes[fn] = "missing"
+    return file_hashes[fn]
 
-    for file in parserfiles: just_typecheck(parserdir, file)
+def result_cache_key(fcn, args):
+    """ the hash of a test's function, source path, arguments and input files, 
+        or None if its source file doesn't exist (such a test is never cached, 
+        since its inputs can't be known) """
+    srcfile, inputs = test_inputs(fcn, args)
+    if not os.path.isfile(srcfile):
+        return None
+    h = hashlib.sha256(json.dumps([fcn.__name__, srcfile, args]).encode())
+    for fn in inputs:
+        h.update("{}:{}\n".format(fn, hash_file(fn)).encode())
+    return h.hexdigest()
 
-    for file in poplfiles: just_typecheck(popldir, file)
+def run_tests(sections, n_jobs):
+    """ run the tests in a list of sections: (header, [(test function, args)]). 
+        Up to n_jobs tests run at once (the work is done by subprocesses, so 
+        threads are enough), but results are reported in order. """
+    jobs = [(fcn, args) for _, tests in sections for (fcn, args) in tests]
+    n_cached = 0
+    try:
+        with ThreadPoolExecutor(max(n_jobs, 1)) as pool:
+            futures = [pool.submit(run_test, job_id, fcn, args) for job_id, (fcn, args) in enumerate(jobs)]
+            next_future = iter(futures)
+            for header, tests in sections:
+                if header:
+                    print(header)
+                for _ in tests:
+                    log = next(next_future).result()
+                    report(log)
+                    n_cached += log.cached
+                    if log.fatal:
+                        # don't start any more tests
+                        for future in futures:
+                            future.cancel()
+                        save_result_cache()
+                        exit(1)
+    finally:
+        for server in servers:
+            server.close()
+    save_result_cache()
+    if n_cached:
+        print("Cached passes: {} of {} tests were unchanged and not rerun (--force to rerun them)".format(n_cached, len(jobs)))
+
+def run_test(job_id, fcn, args):
+    log = TestLog(job_id)
+    log.cache_key = result_cache_key(fcn, args)
+    cached = None if (cmdline_args.force or log.cache_key is None) else result_cache.get(log.cache_key)
+    if cached is not None:
+        log.cached = True
+        log.lines = [line + " [cached pass]" for line in cached["lines"][0:1]]
+        log.cached_outputs = cached["outputs"]
+        return log
+    fcn(*args, log)
+    return log
+
+def report(log):
+    for line in log.lines:
+        print(line)
+    for scratch, final in log.outputs:
+        if os.path.exists(scratch):
+            os.replace(scratch, final)
+        elif os.path.exists(final):
+            # e.g., a test stopped by --fail-fast. don't leave an older output 
+            # that `make promote` would copy into test/expected
+            os.remove(final)
+    # a cached pass's output was the same as the expected output
+    for final in log.cached_outputs:
+        shutil.copyfile("test/expected/"+os.path.basename(final), final)
+    errors.extend(log.errors)
+    bad_successes.extend(log.bad_successes)
+    diffs.extend(log.diffs)
+    passed = not (log.errors or log.bad_successes or log.diffs or log.fatal)
+    if passed and not log.cached and log.cache_key is not None:
+        result_cache[log.cache_key] = {
+            "lines" : log.lines, 
+            "outputs" : [final for _, final in log.outputs]
+        }
+
+if (test_tgt == "interpreter"):
 
-    print("--- application tests ---")
-    for file in appfiles: interp_test(file, [])
+    run_tests([
+        ("--- interpreter tests ---", [(interp_test, (file, [])) for file in interpfiles]),
+        ("--- library tests ---", [(just_typecheck, (librarydir, file)) for file in libraryfiles]),
+        ("--- interactive interpreter tests ---", [(interactive_test, (file, [])) for file in interactivefiles]),
+        ("--- other tests ---", 
+            [(just_typecheck, (regressiondir, file)) for file in regressionfiles]
+            + [(just_typecheck, (parserdir, file)) for file in parserfiles]
+            + [(just_typecheck, (popldir, file)) for file in poplfiles]),
+        ("--- application tests ---", [(interp_test, (file, [])) for file in appfiles])
+    ], cmdline_args.jobs)
 
 
     print("Diffs:", diffs)
@@ -183,4 +552,6 @@ elif (test_tgt == "lucidcc"):
 
     print("testing lucid compiler")
     n_tests = len(interpfiles)
-    for i, file in enumerate(interpfiles): lucidcc_test(n_tests, i, file, ["--lpcap","--debug"])
\ No newline at end of file
+    run_tests([
+        (None, [(lucidcc_test, (n_tests, i, file, ["--lpcap","--debug"])) for i, file in enumerate(interpfiles)])
+    ], cmdline_args.jobs)
\ No newline at end of file